@@ -0,0 +1,197 @@
+"""Benchmarks for erasmus.py: python bench.py <command> --help."""
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import click
+from werkzeug.test import EnvironBuilder
+
+from erasmus import (TestimonialReadModel, app, fetch_testimonials_page, find_duplicate, migrate,
+                     resolve_country, store_fingerprint, text_fingerprint)
+
+@click.group()
+def cli():
+    """Benchmarks run against throwaway databases in a temporary directory."""
+
+BENCH_COUNTRIES = ['Portugal', 'Espanha', 'França', 'Itália', 'Alemanha', 'Polónia', 'Grécia',
+                   'Suécia', 'Irlanda', 'Bélgica', 'Países Baixos', 'Áustria', 'Chéquia', 'Hungria',
+                   'Finlândia', 'Dinamarca', 'Noruega', 'Croácia', 'Eslovénia', 'Roménia']
+BENCH_TAGS = ['cultura', 'amizades', 'aprendizagem', 'idiomas', 'viagens', 'gastronomia',
+              'desporto', 'estágio', 'investigação', 'voluntariado', 'música', 'arte']
+
+def seed_bench_db(database, rows, seed=42):
+    """Fill a fresh database with synthetic testimonials for benchmarks."""
+    rng = random.Random(seed)
+    migrate(database)
+    conn = sqlite3.connect(database)
+    countries = [resolve_country(conn, name, create=True) for name in BENCH_COUNTRIES]
+    conn.executemany('''
+        INSERT INTO testimonials (student_name, country_id, country, university, year, testimonial_text,
+                                  tags, is_approved, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('2015-01-01', ?))
+    ''', ((f'Estudante {i}', *rng.choice(countries), f'Universidade {rng.randrange(200)}',
+           rng.randrange(2000, 2026), 'Uma experiência incrível. ' * rng.randrange(5, 40),
+           ', '.join(rng.sample(BENCH_TAGS, rng.randrange(0, 4))),
+           rng.random() < 0.9, f'+{rng.randrange(10 ** 8)} seconds')
+          for i in range(rows)))
+    conn.execute("DELETE FROM testimonial_changes")
+    conn.commit()
+    conn.close()
+
+@cli.command('read-model')
+@click.option('--rows', default=100000, show_default=True)
+@click.option('--repeat', default=50, show_default=True)
+def bench_read_model(rows, repeat):
+    """Compare /depoimentos queries on SQLite vs the in-memory read model."""
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        seed_bench_db(database, rows)
+        conn = sqlite3.connect(database)
+        conn.row_factory = sqlite3.Row
+
+        model = TestimonialReadModel(database)
+        started = time.perf_counter()
+        model.refresh()
+        load_ms = (time.perf_counter() - started) * 1000
+        # measured on a second instance, tracemalloc skews the timing
+        tracemalloc.start()
+        traced = TestimonialReadModel(database)
+        traced.refresh()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        traced._conn.close()
+        click.echo(f'{len(model._ids)} approved rows loaded in {load_ms:.0f} ms, '
+                   f'{memory / 1024 / 1024:.2f} MB '
+                   f'({len(model._by_country)} countries, {len(model._by_year)} years, '
+                   f'{len(model._by_tag)} tags)')
+
+        cases = [
+            ('unfiltered, page 1', ('', '', '', 6, 0)),
+            ('country', ('Portugal', '', '', 6, 0)),
+            ('country + year + tag', ('Espanha', '2019', 'cultura', 6, 0)),
+            ('year, page 50', ('', '2010', '', 6, 294)),
+        ]
+        click.echo(f"{'query':<24}{'sqlite ms':>12}{'memory ms':>12}")
+        for label, args in cases:
+            timings = []
+            for fetch_page in (fetch_testimonials_page, model.fetch_page):
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    result = fetch_page(conn, *args)
+                timings.append((time.perf_counter() - started) * 1000 / repeat)
+                if fetch_page is fetch_testimonials_page:
+                    expected = result[1]
+                elif result[1] != expected:
+                    raise click.ClickException(f'{label}: count mismatch {result[1]} != {expected}')
+            click.echo(f'{label:<24}{timings[0]:>12.2f}{timings[1]:>12.2f}')
+        conn.close()
+
+@cli.command('dedupe')
+@click.option('--docs', default=5000, show_default=True, help='Distinct testimonials.')
+@click.option('--near', default=1000, show_default=True, help='Edited copies.')
+@click.option('--edit', default=0.05, show_default=True, help='Share of words changed in edited copies.')
+@click.option('--exact', default=500, show_default=True, help='Copies differing only in case/spacing.')
+def bench_dedupe(docs, near, edit, exact):
+    """Precision, recall and insert throughput of duplicate detection."""
+    rng = random.Random(7)
+    vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randrange(3, 9)))
+                  for _ in range(3000)]
+    originals = [[rng.choice(vocabulary) for _ in range(rng.randrange(40, 150))] for _ in range(docs)]
+    corpus = [(' '.join(words), None) for words in originals]
+    for _ in range(near):
+        source = rng.randrange(docs)
+        words = list(originals[source])
+        for i in rng.sample(range(len(words)), max(1, int(len(words) * edit))):
+            words[i] = rng.choice(vocabulary)
+        corpus.append((' '.join(words), source))
+    for _ in range(exact):
+        source = rng.randrange(docs)
+        corpus.append(('  ' + ' '.join(originals[source]).upper() + ' ', source))
+    copies = corpus[docs:]
+    rng.shuffle(copies)
+    corpus[docs:] = copies
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        migrate(database)
+        conn = sqlite3.connect(database)
+        family = {}  # testimonial id -> index of the original it derives from
+        true_positives = false_positives = exact_hits = 0
+        started = time.perf_counter()
+        for text, source in corpus:
+            exact_hash, signature = text_fingerprint(text)
+            duplicate_of, _, is_exact = find_duplicate(conn, exact_hash, signature)
+            cursor = conn.execute('''
+                INSERT INTO testimonials (student_name, country, country_id, university, year, testimonial_text, duplicate_of)
+                VALUES ('bench', 'Portugal', (SELECT id FROM countries WHERE code = 'PT'), 'U', 2020, ?, ?)
+            ''', (text, duplicate_of))
+            store_fingerprint(conn, cursor.lastrowid, exact_hash, signature)
+            family[cursor.lastrowid] = source if source is not None else len(family)
+            if duplicate_of is not None:
+                if source is not None and family[duplicate_of] == source:
+                    true_positives += 1
+                    exact_hits += is_exact
+                else:
+                    false_positives += 1
+        conn.commit()
+        elapsed = time.perf_counter() - started
+        conn.close()
+
+    duplicates = near + exact
+    precision = true_positives / (true_positives + false_positives) if true_positives + false_positives else 1.0
+    click.echo(f'{len(corpus)} inserts in {elapsed:.1f} s ({len(corpus) / elapsed:.0f}/s, '
+               f'{elapsed / len(corpus) * 1000:.2f} ms each)')
+    click.echo(f'precision {precision:.3f}, recall {true_positives / duplicates:.3f} '
+               f'({exact_hits}/{exact} exact copies matched by hash, {false_positives} false positives)')
+
+def _measure_depoimentos(database, per_page, stream, results):
+    """Child process body for the stream benchmark: one request, TTFB and peak RSS."""
+    import resource  # Unix only
+
+    app.config['DATABASE'] = database
+    app.config['STREAM_TEMPLATES'] = stream
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    environ = EnvironBuilder(path='/depoimentos', query_string={'per_page': per_page}).get_environ()
+    started = time.perf_counter()
+    ttfb = None
+    size = 0
+    body = app(environ, lambda status, headers, exc_info=None: None)
+    for chunk in body:
+        if chunk and ttfb is None:
+            ttfb = time.perf_counter() - started
+        size += len(chunk)
+    if hasattr(body, 'close'):
+        body.close()
+    total = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.send((ttfb * 1000, total * 1000, size, rss_after, rss_after - rss_before))
+
+@cli.command('stream')
+@click.option('--rows', default=3000, show_default=True)
+def bench_stream(rows):
+    """TTFB and peak RSS of /depoimentos, buffered vs streamed.
+
+    Each request runs in a forked child so ru_maxrss is per measurement.
+    """
+    context = multiprocessing.get_context('fork')
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        seed_bench_db(database, rows)
+        click.echo(f"{'cards':>6} {'mode':<9}{'ttfb ms':>10}{'total ms':>10}{'KB':>8}{'peak RSS MB':>13}{'growth MB':>11}")
+        for per_page in (6, 100, 1000):
+            for stream in (False, True):
+                parent, child = context.Pipe()
+                process = context.Process(target=_measure_depoimentos, args=(database, per_page, stream, child))
+                process.start()
+                ttfb, total, size, rss, growth = parent.recv()
+                process.join()
+                mode = 'streamed' if stream else 'buffered'
+                click.echo(f'{per_page:>6} {mode:<9}{ttfb:>10.1f}{total:>10.1f}{size / 1024:>8.0f}'
+                           f'{rss / 1024:>13.1f}{growth / 1024:>11.1f}')
+
+if __name__ == '__main__':
+    cli()
@@ -1,69 +1,1171 @@
+import cProfile
+import gzip
+import hashlib
+import heapq
+import json
 import os
+import pstats
+import random
+import re
+import secrets
+import shutil
 import sqlite3
+import statistics
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right, insort
 from datetime import datetime
+from urllib.parse import quote_plus, urlencode
+import click
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_from_directory
+from werkzeug.utils import secure_filename
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from flask import (Flask, render_template, stream_template, request, redirect, url_for, flash, jsonify, session,
+                   send_from_directory, g)
 
 app = Flask(__name__)
 app.secret_key = 'erasmus_super_secret_key_2024'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
+app.config['DATABASE'] = os.environ.get('ERASMUS_DATABASE', 'erasmus.db')
+app.config['ARCHIVE_DATABASE'] = os.environ.get('ERASMUS_ARCHIVE_DATABASE', 'erasmus_archive.db')
+# Serve the public listing from the in-memory read model instead of SQLite
+app.config['READ_MODEL'] = os.environ.get('ERASMUS_READ_MODEL') == '1'
+# Stream /depoimentos with stream_template instead of buffering the whole page
+app.config['STREAM_TEMPLATES'] = os.environ.get('ERASMUS_STREAM_TEMPLATES') == '1'
+
+# Where uploaded videos live: 'local' (sharded UPLOAD_FOLDER) or 's3' (any S3-compatible endpoint)
+app.config['UPLOAD_STORAGE'] = os.environ.get('ERASMUS_UPLOAD_STORAGE', 'local')
+app.config['S3_BUCKET'] = os.environ.get('ERASMUS_S3_BUCKET', 'erasmus-uploads')
+app.config['S3_PREFIX'] = os.environ.get('ERASMUS_S3_PREFIX', 'uploads/')
+app.config['S3_ENDPOINT_URL'] = os.environ.get('ERASMUS_S3_ENDPOINT_URL')  # e.g. http://localhost:9000 for MinIO
+app.config['S3_PRESIGN_SECONDS'] = 3600
+# Request profiling (ERASMUS_PROFILING=1): allows signed-header / ?_profile=1 (admin) profiles; off installs no hooks
+app.config['PROFILING'] = os.environ.get('ERASMUS_PROFILING') == '1'
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('ERASMUS_PROFILE_SAMPLE_RATE', '0'))  # 0.01 = 1% of requests
+app.config['PROFILE_DIR'] = os.environ.get('ERASMUS_PROFILE_DIR', 'profiles')
+app.config['PROFILE_KEEP'] = 50
+# Static freeze of the public pages (`flask freeze`); re-frozen in the background on approve/delete if enabled
+app.config['FREEZE_DIR'] = os.environ.get('ERASMUS_FREEZE_DIR', 'frozen')
+app.config['FREEZE_ON_CHANGE'] = os.environ.get('ERASMUS_FREEZE_ON_CHANGE') == '1'
+
+# ------------------ Schema migrations ------------------
+# Each step runs on an autocommit connection and must be safe to re-run:
+# a step interrupted halfway is simply applied again by the next migrate.
+# Keep write locks short: DDL goes in its own small transaction and
+# backfills go through backfill_in_batches().
+
+class transaction:
+    """BEGIN IMMEDIATE ... COMMIT on an autocommit connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+def add_column(conn, table, column, definition):
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        with transaction(conn):
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def backfill_in_batches(conn, table, assignments, where, batch_size=1000):
+    """UPDATE rows matching `where` in batches, committing after each one.
+
+    `where` must stop matching a row once it has been updated, otherwise
+    the loop never ends.
+    """
+    while True:
+        with transaction(conn):
+            updated = conn.execute(f'''
+                UPDATE {table} SET {assignments}
+                WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT ?)
+            ''', (batch_size,)).rowcount
+        if updated < batch_size:
+            return
+
+def _migration_initial_schema(conn):
+    with transaction(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                is_admin BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
 
-# Ensure upload folder exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-# ------------------ Database initialization ------------------
-def init_db():
-    conn = sqlite3.connect('erasmus.db')
-    c = conn.cursor()
-
-    # users table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            is_admin BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # testimonials table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS testimonials (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            student_name TEXT NOT NULL,
-            country TEXT NOT NULL,
-            university TEXT NOT NULL,
-            year INTEGER NOT NULL,
-            testimonial_text TEXT NOT NULL,
-            video_url TEXT,
-            video_file TEXT,
-            tags TEXT,
-            is_approved BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            user_id INTEGER,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS testimonials (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                student_name TEXT NOT NULL,
+                country TEXT NOT NULL,
+                university TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                testimonial_text TEXT NOT NULL,
+                video_url TEXT,
+                video_file TEXT,
+                tags TEXT,
+                is_approved BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                user_id INTEGER,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+
+        # default admin
+        admin_exists = conn.execute("SELECT * FROM users WHERE username = 'admin'").fetchone()
+        if not admin_exists:
+            password_hash = generate_password_hash('admin123')
+            conn.execute("INSERT INTO users (username, password_hash, is_admin) VALUES (?, ?, ?)",
+                         ('admin', password_hash, True))
+
+def _migration_change_log(conn):
+    # change log read by the in-memory read model (one row per touched testimonial)
+    with transaction(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS testimonial_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                testimonial_id INTEGER NOT NULL
+            )
+        ''')
+        for event, ref in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS testimonials_log_{event.lower()}
+                AFTER {event} ON testimonials
+                BEGIN
+                    INSERT INTO testimonial_changes (testimonial_id) VALUES ({ref}.id);
+                END
+            ''')
+
+def _migration_listing_indexes(conn):
+    # one index per transaction so the writer is never held for all of them
+    for name, columns in (('idx_testimonials_approved_created', 'is_approved, created_at'),
+                          ('idx_testimonials_approved_country', 'is_approved, country'),
+                          ('idx_testimonials_approved_year', 'is_approved, year')):
+        with transaction(conn):
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON testimonials ({columns})')
+
+def _migration_wal(conn):
+    # readers no longer block the writer (and vice versa)
+    conn.execute('PRAGMA journal_mode=WAL')
+
+def _migration_game_scores(conn):
+    with transaction(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS game_scores (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                player_name TEXT NOT NULL,
+                score INTEGER NOT NULL,
+                rounds INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # matches the leaderboard ORDER BY, so top-N reads N index entries
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_game_scores_rank ON game_scores (score DESC, created_at)')
+
+def _migration_duplicate_index(conn):
+    add_column(conn, 'testimonials', 'duplicate_of', 'INTEGER')
+    with transaction(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS testimonial_fingerprints (
+                testimonial_id INTEGER PRIMARY KEY,
+                exact_hash TEXT NOT NULL,
+                minhash BLOB NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_fingerprints_exact ON testimonial_fingerprints (exact_hash)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS testimonial_lsh (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                testimonial_id INTEGER NOT NULL,
+                PRIMARY KEY (band, bucket, testimonial_id)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_lsh_testimonial ON testimonial_lsh (testimonial_id)')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS testimonials_fingerprint_delete
+            AFTER DELETE ON testimonials
+            BEGIN
+                DELETE FROM testimonial_fingerprints WHERE testimonial_id = OLD.id;
+                DELETE FROM testimonial_lsh WHERE testimonial_id = OLD.id;
+            END
+        ''')
+
+def _migration_moderation_claims(conn):
+    add_column(conn, 'testimonials', 'claimed_by', 'INTEGER REFERENCES users (id)')
+    add_column(conn, 'testimonials', 'claimed_until', 'TIMESTAMP')
+    with transaction(conn):
+        # only pending rows: stays small however large the approved archive grows
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_testimonials_pending
+            ON testimonials (created_at, id) WHERE is_approved = 0
+        ''')
+
+def _migration_data_version(conn):
+    # bumped in the writing transaction whenever publicly visible (approved) rows change;
+    # pending inserts and moderation claims leave it alone
+    with transaction(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS data_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)')
+        for event, condition in (('INSERT', 'NEW.is_approved = 1'),
+                                 ('UPDATE', 'OLD.is_approved = 1 OR NEW.is_approved = 1'),
+                                 ('DELETE', 'OLD.is_approved = 1')):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS testimonials_version_{event.lower()}
+                AFTER {event} ON testimonials
+                WHEN {condition}
+                BEGIN
+                    UPDATE data_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+def _migration_countries(conn):
+    # country_id is what filters and GROUP BYs use; testimonials.country keeps what the student typed.
+    # A fixed copy of the seed, so this migration gives the same result on every database:
+    # (ISO code, Portuguese name, English name, extra aliases)
+    seed = [
+        ('AT', 'Áustria', 'Austria', ['Österreich']),
+        ('BE', 'Bélgica', 'Belgium', ['Belgique', 'België']),
+        ('BG', 'Bulgária', 'Bulgaria', []),
+        ('CY', 'Chipre', 'Cyprus', []),
+        ('CZ', 'Chéquia', 'Czechia', ['República Checa', 'Czech Republic']),
+        ('DE', 'Alemanha', 'Germany', ['Deutschland']),
+        ('DK', 'Dinamarca', 'Denmark', ['Danmark']),
+        ('EE', 'Estónia', 'Estonia', ['Estônia', 'Eesti']),
+        ('ES', 'Espanha', 'Spain', ['España']),
+        ('FI', 'Finlândia', 'Finland', ['Suomi']),
+        ('FR', 'França', 'France', []),
+        ('GR', 'Grécia', 'Greece', ['Hellas']),
+        ('HR', 'Croácia', 'Croatia', ['Hrvatska']),
+        ('HU', 'Hungria', 'Hungary', ['Magyarország']),
+        ('IE', 'Irlanda', 'Ireland', ['Éire']),
+        ('IS', 'Islândia', 'Iceland', ['Ísland']),
+        ('IT', 'Itália', 'Italy', ['Italia']),
+        ('LI', 'Listenstaine', 'Liechtenstein', []),
+        ('LT', 'Lituânia', 'Lithuania', ['Lietuva']),
+        ('LU', 'Luxemburgo', 'Luxembourg', []),
+        ('LV', 'Letónia', 'Latvia', ['Letônia', 'Latvija']),
+        ('MK', 'Macedónia do Norte', 'North Macedonia', ['Macedônia do Norte', 'Macedónia']),
+        ('MT', 'Malta', 'Malta', []),
+        ('NL', 'Países Baixos', 'Netherlands', ['Holanda', 'Holland', 'Nederland']),
+        ('NO', 'Noruega', 'Norway', ['Norge']),
+        ('PL', 'Polónia', 'Poland', ['Polônia', 'Polska']),
+        ('PT', 'Portugal', 'Portugal', []),
+        ('RO', 'Roménia', 'Romania', ['Romênia', 'România']),
+        ('RS', 'Sérvia', 'Serbia', ['Srbija']),
+        ('SE', 'Suécia', 'Sweden', ['Sverige']),
+        ('SI', 'Eslovénia', 'Slovenia', ['Eslovênia', 'Slovenija']),
+        ('SK', 'Eslováquia', 'Slovakia', ['Slovensko']),
+        ('TR', 'Turquia', 'Turkey', ['Türkiye']),
+    ]
+    with transaction(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS countries (
+                id INTEGER PRIMARY KEY,
+                code TEXT UNIQUE,
+                name_pt TEXT NOT NULL,
+                name_en TEXT
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS country_aliases (
+                alias TEXT PRIMARY KEY,
+                country_id INTEGER NOT NULL REFERENCES countries (id)
+            ) WITHOUT ROWID
+        ''')
+        for code, name, english, aliases in seed:
+            conn.execute('INSERT OR IGNORE INTO countries (code, name_pt, name_en) VALUES (?, ?, ?)',
+                         (code, name, english))
+            country_id = conn.execute('SELECT id FROM countries WHERE code = ?', (code,)).fetchone()[0]
+            conn.executemany('INSERT OR IGNORE INTO country_aliases (alias, country_id) VALUES (?, ?)',
+                             [(normalize_name(alias), country_id) for alias in [code, name, english, *aliases]])
+    add_column(conn, 'testimonials', 'country_id', 'INTEGER REFERENCES countries (id)')
+
+    conn.create_function('normalize_name', 1, normalize_name, deterministic=True)
+    # approved rows were moderated, so a country outside the seed becomes one of its own;
+    # pending rows only get a country_id if they match, the rest is settled on approval
+    unknown = {}
+    for (country,) in conn.execute('''
+            SELECT DISTINCT country FROM testimonials
+            WHERE is_approved = 1 AND normalize_name(country) NOT IN (SELECT alias FROM country_aliases)
+    '''):
+        unknown.setdefault(normalize_name(country), ' '.join(country.split()))
+    with transaction(conn):
+        for alias, name in unknown.items():
+            country_id = conn.execute('INSERT INTO countries (name_pt) VALUES (?)', (name,)).lastrowid
+            conn.execute('INSERT INTO country_aliases (alias, country_id) VALUES (?, ?)', (alias, country_id))
+    backfill_in_batches(conn, 'testimonials',
+                        'country_id = (SELECT country_id FROM country_aliases WHERE alias = normalize_name(country))',
+                        'country_id IS NULL AND normalize_name(country) IN (SELECT alias FROM country_aliases)')
+
+    with transaction(conn):
+        conn.execute('DROP INDEX IF EXISTS idx_testimonials_approved_country')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_testimonials_approved_country_id
+            ON testimonials (is_approved, country_id)
+        ''')
+    prune_change_log(conn)
+
+def _migration_game_rounds(conn):
+    # round answers stay on the server; the client only holds the opaque batch id
+    with transaction(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS game_rounds (
+                batch_id TEXT NOT NULL,
+                round INTEGER NOT NULL,
+                country_code TEXT NOT NULL,
+                correct INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (batch_id, round)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_game_rounds_created ON game_rounds (created_at)')
+    add_column(conn, 'game_scores', 'batch_id', 'TEXT')
+    with transaction(conn):
+        # a batch can be scored once
+        conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_game_scores_batch ON game_scores (batch_id)')
+
+def _migration_country_raw(conn):
+    # testimonials.country shows the canonical name; country_raw keeps what the student typed
+    add_column(conn, 'testimonials', 'country_raw', 'TEXT')
+    backfill_in_batches(conn, 'testimonials', 'country_raw = country', 'country_raw IS NULL')
+    backfill_in_batches(conn, 'testimonials', 'country = (SELECT name_pt FROM countries WHERE id = country_id)',
+                        'country IS NOT (SELECT name_pt FROM countries WHERE id = country_id) AND country_id IS NOT NULL')
+    prune_change_log(conn)
+
+MIGRATIONS = [
+    (1, 'initial schema', _migration_initial_schema),
+    (2, 'testimonial change log', _migration_change_log),
+    (3, 'listing indexes', _migration_listing_indexes),
+    (4, 'WAL journal mode', _migration_wal),
+    (5, 'game scores', _migration_game_scores),
+    (6, 'duplicate detection index', _migration_duplicate_index),
+    (7, 'moderation claims', _migration_moderation_claims),
+    (8, 'data version counter', _migration_data_version),
+    (9, 'canonical countries', _migration_countries),
+    (10, 'server-side game rounds', _migration_game_rounds),
+    (11, 'canonical country names', _migration_country_raw),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    try:
+        return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
 
-    # default admin
-    admin_exists = c.execute("SELECT * FROM users WHERE username = 'admin'").fetchone()
-    if not admin_exists:
-        password_hash = generate_password_hash('admin123')
-        c.execute("INSERT INTO users (username, password_hash, is_admin) VALUES (?, ?, ?)",
-                  ('admin', password_hash, True))
+def migrate(database=None, target=None, echo=None):
+    """Apply pending migrations up to `target` (default: latest)."""
+    conn = sqlite3.connect(database or app.config['DATABASE'], isolation_level=None)
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        current = get_schema_version(conn)
+        for version, name, step in MIGRATIONS:
+            if version <= current or (target is not None and version > target):
+                continue
+            if echo:
+                echo(f'Applying {version:03d} {name}...')
+            step(conn)
+            with transaction(conn):
+                conn.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+            current = version
+        return current
+    finally:
+        conn.close()
 
-    conn.commit()
-    conn.close()
+def verify_schema():
+    """Check the database is at SCHEMA_VERSION without touching it."""
+    conn = sqlite3.connect(app.config['DATABASE'])
+    try:
+        current = get_schema_version(conn)
+    finally:
+        conn.close()
+    if current < SCHEMA_VERSION:
+        app.logger.warning('Schema version %s is behind %s: run `flask --app erasmus migrate`.',
+                           current, SCHEMA_VERSION)
+    elif current > SCHEMA_VERSION:
+        app.logger.warning('Schema version %s is newer than this code (%s).', current, SCHEMA_VERSION)
+    return current >= SCHEMA_VERSION
 
-init_db()
+schema_ready = verify_schema()
 
-def get_db_connection():
-    conn = sqlite3.connect('erasmus.db')
+def get_db_connection(include_archive=False):
+    conn = sqlite3.connect(app.config['DATABASE'])
     conn.row_factory = sqlite3.Row
+    if include_archive:
+        attach_archive(conn)
     return conn
 
+CHANGE_LOG_KEEP = 10000
+
+def prune_change_log(conn):
+    # readers further behind than this reload from scratch
+    conn.execute('''
+        DELETE FROM testimonial_changes
+        WHERE seq <= (SELECT MAX(seq) FROM testimonial_changes) - ?
+    ''', (CHANGE_LOG_KEEP,))
+
+# ------------------ Countries ------------------
+def normalize_name(text):
+    """Casefold, drop accents and collapse whitespace ('  Suécia ' -> 'suecia')."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.casefold().split())
+
+COUNTRY_MAX_LENGTH = 60
+
+def resolve_country(conn, text, create=False):
+    """Return (country_id, canonical name) for a typed country, or None if unknown.
+
+    'espanha', 'Spain' and 'ES' all resolve to Espanha through
+    country_aliases. With create=True (moderator approval only) an unknown
+    name becomes a country of its own under that spelling, so later
+    variants of it collapse onto the same row.
+    """
+    spelling = ' '.join((text or '').split())
+    alias = normalize_name(spelling)
+    row = conn.execute('''
+        SELECT c.id, c.name_pt FROM country_aliases a JOIN countries c ON c.id = a.country_id
+        WHERE a.alias = ?
+    ''', (alias,)).fetchone()
+    if row:
+        return row[0], row[1]
+    if not create or not alias:
+        return None
+    country_id = conn.execute('INSERT INTO countries (name_pt) VALUES (?)', (spelling,)).lastrowid
+    conn.execute('INSERT INTO country_aliases (alias, country_id) VALUES (?, ?)', (alias, country_id))
+    return country_id, spelling
+
+def flag_countries(conn):
+    """{ISO code: Portuguese name} for the countries that have a flag."""
+    return dict(conn.execute('SELECT code, name_pt FROM countries WHERE code IS NOT NULL ORDER BY code').fetchall())
+
+# ------------------ Duplicate detection ------------------
+# Every testimonial gets an exact hash of its normalized text plus a MinHash
+# signature over word 2-grams. The signature is cut into LSH bands; two texts
+# become candidates when any band hashes to the same bucket, so a lookup is
+# MINHASH_BANDS index probes whatever the table size. With 16 bands of 4 rows
+# a pair at Jaccard 0.7 collides with probability ~0.99 and one at 0.3 with
+# ~0.12; candidates are then confirmed against NEAR_DUPLICATE_THRESHOLD.
+MINHASH_BANDS = 16
+MINHASH_ROWS = 4
+NEAR_DUPLICATE_THRESHOLD = 0.7
+_MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(20240601)  # fixed: stored signatures must stay comparable
+MINHASH_PERMUTATIONS = [(_minhash_rng.randrange(1, _MINHASH_PRIME), _minhash_rng.randrange(_MINHASH_PRIME))
+                        for _ in range(MINHASH_BANDS * MINHASH_ROWS)]
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def text_fingerprint(text):
+    """Return (exact_hash, minhash signature) for a testimonial text."""
+    words = re.findall(r'\w+', normalize_name(text))
+    exact_hash = hashlib.sha1(' '.join(words).encode('utf-8')).hexdigest()
+    shingles = {' '.join(words[i:i + 2]) for i in range(max(len(words) - 1, 1))}
+    hashes = [_hash64(shingle) for shingle in shingles]
+    signature = [min((a * h + b) % _MINHASH_PRIME for h in hashes) for a, b in MINHASH_PERMUTATIONS]
+    return exact_hash, signature
+
+def lsh_buckets(signature):
+    for band in range(MINHASH_BANDS):
+        rows = array('Q', signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]).tobytes()
+        yield band, int.from_bytes(hashlib.blake2b(rows, digest_size=8).digest(), 'big', signed=True)
+
+def signature_similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+def find_duplicate(conn, exact_hash, signature, before_id=None):
+    """Return (testimonial_id, similarity, exact) for the closest earlier match.
+
+    testimonial_id is None when nothing reaches NEAR_DUPLICATE_THRESHOLD.
+    """
+    limit_id = before_id if before_id is not None else 1 << 62
+    row = conn.execute('''
+        SELECT testimonial_id FROM testimonial_fingerprints
+        WHERE exact_hash = ? AND testimonial_id < ?
+        ORDER BY testimonial_id LIMIT 1
+    ''', (exact_hash, limit_id)).fetchone()
+    if row:
+        return row[0], 1.0, True
+
+    candidates = set()
+    for band, bucket in lsh_buckets(signature):
+        candidates.update(r[0] for r in conn.execute(
+            'SELECT testimonial_id FROM testimonial_lsh WHERE band = ? AND bucket = ? AND testimonial_id < ?',
+            (band, bucket, limit_id)))
+    best_id, best_similarity = None, 0
+    for candidate in sorted(candidates):
+        stored = conn.execute('SELECT minhash FROM testimonial_fingerprints WHERE testimonial_id = ?',
+                              (candidate,)).fetchone()
+        similarity = signature_similarity(signature, array('Q', stored[0]))
+        if similarity >= NEAR_DUPLICATE_THRESHOLD and similarity > best_similarity:
+            best_id, best_similarity = candidate, similarity
+    return best_id, best_similarity, False
+
+def store_fingerprint(conn, testimonial_id, exact_hash, signature):
+    conn.execute('INSERT OR REPLACE INTO testimonial_fingerprints (testimonial_id, exact_hash, minhash) VALUES (?, ?, ?)',
+                 (testimonial_id, exact_hash, array('Q', signature).tobytes()))
+    conn.executemany('INSERT OR IGNORE INTO testimonial_lsh (band, bucket, testimonial_id) VALUES (?, ?, ?)',
+                     ((band, bucket, testimonial_id) for band, bucket in lsh_buckets(signature)))
+
+# ------------------ Public listing queries ------------------
+def split_tags(tags):
+    return [t.strip() for t in tags.split(',') if t.strip()] if tags else []
+
+def fetch_testimonials_page(conn, country_filter, year_filter, tag_filter, per_page, offset, lazy=False):
+    """Run the /depoimentos queries against SQLite.
+
+    Returns (testimonials, total_count, countries, years, tags). With
+    lazy=True testimonials is the open cursor instead of a list, so rows
+    are read as the template renders them.
+    """
+    query = "SELECT * FROM testimonials WHERE is_approved = 1"
+    params = []
+    if country_filter:
+        query += " AND country_id = (SELECT country_id FROM country_aliases WHERE alias = ?)"
+        params.append(normalize_name(country_filter))
+    if year_filter:
+        query += " AND year = ?"
+        params.append(int(year_filter))
+    if tag_filter:
+        query += " AND tags LIKE ?"
+        params.append(f'%{tag_filter}%')
+
+    query += " ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?"
+    params.extend([per_page, offset])
+    cursor = conn.execute(query, params)
+    testimonials = cursor if lazy else cursor.fetchall()
+
+    # total count
+    count_query = "SELECT COUNT(*) FROM testimonials WHERE is_approved = 1"
+    count_params = []
+    if country_filter:
+        count_query += " AND country_id = (SELECT country_id FROM country_aliases WHERE alias = ?)"
+        count_params.append(normalize_name(country_filter))
+    if year_filter:
+        count_query += " AND year = ?"
+        count_params.append(int(year_filter))
+    if tag_filter:
+        count_query += " AND tags LIKE ?"
+        count_params.append(f'%{tag_filter}%')
+
+    total_count = conn.execute(count_query, count_params).fetchone()[0]
+
+    # filters options
+    countries = conn.execute('''
+        SELECT name_pt AS country FROM countries
+        WHERE id IN (SELECT country_id FROM testimonials WHERE is_approved = 1)
+        ORDER BY name_pt
+    ''').fetchall()
+    years = conn.execute("SELECT DISTINCT year FROM testimonials WHERE is_approved = 1 ORDER BY year DESC").fetchall()
+
+    all_tags = conn.execute("SELECT tags FROM testimonials WHERE is_approved = 1 AND tags IS NOT NULL").fetchall()
+    tags_set = set()
+    for tag_row in all_tags:
+        tags_set.update(split_tags(tag_row['tags']))
+    tags = sorted(tags_set)
+
+    return testimonials, total_count, countries, years, tags
+
+# ------------------ In-memory read model ------------------
+def read_changes(conn, since_seq):
+    """Return (last seq, changed testimonial ids) logged after since_seq.
+
+    Returns None when testimonial_changes has been pruned past since_seq
+    and the caller has to reload from scratch.
+    """
+    first_seq = conn.execute("SELECT MIN(seq) FROM testimonial_changes").fetchone()[0]
+    if first_seq is not None and first_seq > since_seq + 1:
+        return None
+    changed = {}
+    for seq, testimonial_id in conn.execute(
+            "SELECT seq, testimonial_id FROM testimonial_changes WHERE seq > ? ORDER BY seq", (since_seq,)):
+        since_seq = seq
+        changed[testimonial_id] = True
+    return since_seq, list(changed)
+
+class ChangeLogCache:
+    """In-memory view of approved testimonials kept current from testimonial_changes.
+
+    Each refresh() polls PRAGMA data_version on the cache's own
+    connection and, when another connection has committed, replays
+    testimonial_changes since the last seen seq. Subclasses implement
+    _load() to rebuild from scratch and _apply(testimonial_id) to re-read
+    one changed row; both run under self._lock.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self._lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        self._seq = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _apply(self, testimonial_id):
+        raise NotImplementedError
+
+    def _reload(self):
+        self._seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM testimonial_changes").fetchone()[0]
+        self._load()
+
+    def refresh(self):
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+                self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+                self._reload()
+                return
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return
+            self._data_version = data_version
+
+            changes = read_changes(self._conn, self._seq)
+            if changes is None:
+                # log was pruned past us
+                self._reload()
+                return
+            self._seq, changed = changes
+            for testimonial_id in changed:
+                self._apply(testimonial_id)
+
+class TestimonialReadModel(ChangeLogCache):
+    """Approved testimonials held in memory for the public listing.
+
+    Rows are kept in slots ordered by (created_at, id). Ids and creation
+    times live in typed arrays; every country, year and tag value owns a
+    bitmap (a Python int) with bit i set when slot i carries that value.
+    Filters are ANDs of bitmaps, counts are popcounts and facets are the
+    non-empty bitmaps; only the rows of the requested page are read back
+    from SQLite, by primary key.
+
+    Memory is independent of the testimonial text: 16 bytes per row for
+    the arrays plus one bitmap of n/8 bytes per distinct value. For 100k
+    rows that is 1.6 MB + 12.5 KB per value, about 5 MB with 30
+    countries, 40 years and 200 tags (see `python bench.py read-model`).
+
+    Changes are picked up incrementally on each request (see
+    ChangeLogCache). The tag filter matches any tag containing the filter
+    text (case-insensitive), like the LIKE '%tag%' of the SQL path.
+    """
+
+    def __init__(self, database):
+        super().__init__(database)
+        self._reset()
+
+    def _reset(self):
+        self._ids = array('q')
+        self._created = array('q')
+        self._by_country = {}
+        self._by_year = {}
+        self._by_tag = {}
+
+    def _select(self, where, params=()):
+        return self._conn.execute(f'''
+            SELECT id, country_id, year, tags,
+                   COALESCE(CAST(strftime('%s', created_at) AS INTEGER), 0) AS created
+            FROM testimonials
+            WHERE is_approved = 1 {where}
+        ''', params)
+
+    def _load_country_names(self):
+        self._country_names = dict(self._conn.execute('SELECT id, name_pt FROM countries').fetchall())
+
+    def _load(self):
+        self._reset()
+        self._load_country_names()
+        rows = self._select("ORDER BY created, id").fetchall()
+        size = (len(rows) + 7) // 8
+        bits = {}
+        for pos, row in enumerate(rows):
+            self._ids.append(row['id'])
+            self._created.append(row['created'])
+            byte, mask = pos >> 3, 1 << (pos & 7)
+            for index, key in self._keys(row):
+                buf = bits.get((id(index), key))
+                if buf is None:
+                    buf = bits[(id(index), key)] = (index, bytearray(size))
+                buf[1][byte] |= mask
+        for (_, key), (index, buf) in bits.items():
+            index[key] = int.from_bytes(buf, 'little')
+
+    def _append(self, row):
+        bit = 1 << len(self._ids)
+        self._ids.append(row['id'])
+        self._created.append(row['created'])
+        for index, key in self._keys(row):
+            index[key] = index.get(key, 0) | bit
+
+    def _keys(self, row):
+        keys = [(self._by_country, row['country_id']), (self._by_year, row['year'])]
+        keys.extend((self._by_tag, tag) for tag in set(split_tags(row['tags'])))
+        return keys
+
+    def _bitmaps(self):
+        return (self._by_country, self._by_year, self._by_tag)
+
+    def _insert(self, row):
+        lo = bisect_left(self._created, row['created'])
+        hi = bisect_right(self._created, row['created'])
+        pos = lo + bisect_left(self._ids[lo:hi], row['id'])
+        if pos == len(self._ids):
+            self._append(row)
+            return
+        # open a gap at pos in every bitmap
+        low_mask = (1 << pos) - 1
+        for index in self._bitmaps():
+            for key, bitmap in index.items():
+                index[key] = ((bitmap >> pos) << (pos + 1)) | (bitmap & low_mask)
+        self._ids.insert(pos, row['id'])
+        self._created.insert(pos, row['created'])
+        bit = 1 << pos
+        for index, key in self._keys(row):
+            index[key] = index.get(key, 0) | bit
+
+    def _remove(self, pos):
+        low_mask = (1 << pos) - 1
+        for index in self._bitmaps():
+            for key, bitmap in list(index.items()):
+                bitmap = ((bitmap >> (pos + 1)) << pos) | (bitmap & low_mask)
+                if bitmap:
+                    index[key] = bitmap
+                else:
+                    del index[key]
+        del self._ids[pos]
+        del self._created[pos]
+
+    def _apply(self, testimonial_id):
+        try:
+            self._remove(self._ids.index(testimonial_id))
+        except ValueError:
+            pass
+        row = self._select("AND id = ?", (testimonial_id,)).fetchone()
+        if row:
+            if row['country_id'] not in self._country_names:
+                self._load_country_names()
+            self._insert(row)
+
+    def _match(self, country_filter, year_filter, tag_filter):
+        bitmap = (1 << len(self._ids)) - 1
+        if country_filter:
+            country_id = self._conn.execute('SELECT country_id FROM country_aliases WHERE alias = ?',
+                                            (normalize_name(country_filter),)).fetchone()
+            bitmap &= self._by_country.get(country_id and country_id[0], 0)
+        if year_filter:
+            bitmap &= self._by_year.get(int(year_filter), 0)
+        if tag_filter:
+            needle = tag_filter.lower()
+            tagged = 0
+            for tag, tag_bitmap in self._by_tag.items():
+                if needle in tag.lower():
+                    tagged |= tag_bitmap
+            bitmap &= tagged
+        return bitmap
+
+    def query(self, country_filter, year_filter, tag_filter, per_page, offset):
+        """Return (ids, total_count, countries, years, tags) for one page."""
+        self.refresh()
+        with self._lock:
+            bitmap = self._match(country_filter, year_filter, tag_filter)
+            total_count = bitmap.bit_count()
+            # newest first: walk set bits from the top
+            ids = []
+            skipped = 0
+            while bitmap and len(ids) < per_page:
+                pos = bitmap.bit_length() - 1
+                bitmap ^= 1 << pos
+                if skipped < offset:
+                    skipped += 1
+                else:
+                    ids.append(self._ids[pos])
+            countries = [{'country': c} for c in sorted(self._country_names.get(i, '') for i in self._by_country)]
+            years = [{'year': y} for y in sorted(self._by_year, reverse=True)]
+            tags = sorted(self._by_tag)
+        return ids, total_count, countries, years, tags
+
+    def fetch_page(self, conn, country_filter, year_filter, tag_filter, per_page, offset, lazy=False):
+        """Same contract as fetch_testimonials_page()."""
+        ids, total_count, countries, years, tags = self.query(
+            country_filter, year_filter, tag_filter, per_page, offset)
+        testimonials = []
+        if lazy:
+            testimonials = (row for row in (
+                conn.execute("SELECT * FROM testimonials WHERE id = ?", (i,)).fetchone() for i in ids) if row)
+        elif ids:
+            placeholders = ','.join('?' * len(ids))
+            rows = {row['id']: row for row in conn.execute(
+                f"SELECT * FROM testimonials WHERE id IN ({placeholders})", ids)}
+            testimonials = [rows[i] for i in ids if i in rows]
+        return testimonials, total_count, countries, years, tags
+
+read_model = TestimonialReadModel(app.config['DATABASE'])
+
+# ------------------ Autocomplete ------------------
+class PrefixIndex:
+    """Accent-insensitive prefix search over one column, ranked by frequency.
+
+    Names are kept in normalize_name() form in a sorted list, so the
+    matches for a prefix are one bisect range. Spellings that normalize
+    alike ('Itália', 'italia') share an entry, shown in its most common
+    spelling. `aliases` maps extra normalized names to a canonical display
+    name ('germany' -> 'Alemanha'); those entries always exist and gather
+    the counts of every alias, but are only suggested once they count an
+    approved row.
+
+    Ranking a short prefix touches every matching entry, so results are
+    cached per (prefix, limit) until the next change.
+    """
+
+    CACHE_MAX = 4096
+
+    def __init__(self, aliases=None):
+        self._names = []  # sorted normalized names, aliases included
+        self._target = {}  # normalized name -> entry key
+        self._spellings = {}  # entry key -> {spelling: approved rows}
+        self._totals = {}  # entry key -> approved rows
+        self._fixed = {}  # entry key -> canonical display name
+        self._normalized = {}  # spelling -> normalized name
+        self._cache = {}
+        for alias, display in (aliases or {}).items():
+            key = normalize_name(display)
+            self._fixed[key] = display
+            self._totals[key] = 0
+            self._link(key, key)
+            self._link(alias, key)
+
+    def _link(self, name, key):
+        if name not in self._target:
+            insort(self._names, name)
+        self._target[name] = key
+
+    def add(self, value, delta=1):
+        self._cache.clear()
+        spelling = ' '.join((value or '').split())
+        name = self._normalized.get(spelling)
+        if name is None:
+            name = self._normalized[spelling] = normalize_name(spelling)
+        if not name:
+            return
+        key = self._target.get(name)
+        if key is None:
+            key = name
+            self._link(name, key)
+        spellings = self._spellings.setdefault(key, {})
+        count = spellings.get(spelling, 0) + delta
+        if count > 0:
+            spellings[spelling] = count
+        else:
+            spellings.pop(spelling, None)
+            self._normalized.pop(spelling, None)
+        self._totals[key] = self._totals.get(key, 0) + delta
+        if not spellings:
+            del self._spellings[key]
+            if key not in self._fixed:
+                del self._totals[key]
+                del self._target[key]
+                del self._names[bisect_left(self._names, key)]
+
+    def display(self, key):
+        if key in self._fixed:
+            return self._fixed[key]
+        spellings = self._spellings[key]
+        return max(spellings, key=lambda spelling: (spellings[spelling], spelling))
+
+    def search(self, prefix, limit):
+        prefix = normalize_name(prefix)
+        results = self._cache.get((prefix, limit))
+        if results is None:
+            lo = bisect_left(self._names, prefix)
+            hi = bisect_left(self._names, prefix + '\U0010ffff', lo)
+            # seeded aliases only map spellings; a country nobody has written about is no suggestion
+            keys = {key for key in map(self._target.get, self._names[lo:hi]) if self._totals[key] > 0}
+            best = heapq.nsmallest(limit, keys, key=lambda key: (-self._totals[key], key))
+            results = [{'value': self.display(key), 'count': self._totals[key]} for key in best]
+            if len(self._cache) >= self.CACHE_MAX:
+                self._cache.clear()
+            self._cache[(prefix, limit)] = results
+        return results
+
+class AutocompleteIndex(ChangeLogCache):
+    """Prefix indexes for the country and university of approved testimonials.
+
+    Kept current the same way as the read model (see ChangeLogCache). Countries
+    are seeded from country_aliases so aliases ('Italy', 'Italia')
+    resolve to one Portuguese name.
+    """
+
+    FIELDS = ('country', 'university')
+
+    def __init__(self, database):
+        super().__init__(database)
+        self._rows = {}
+
+    def _index(self, values, delta):
+        for field, value in zip(self.FIELDS, values):
+            self._indexes[field].add(value, delta)
+
+    def _select(self, where, params=()):
+        return self._conn.execute(
+            f"SELECT id, country, university FROM testimonials WHERE is_approved = 1 {where}", params)
+
+    def _load(self):
+        self._indexes = {
+            'country': PrefixIndex(dict(self._conn.execute('''
+                SELECT a.alias, c.name_pt FROM country_aliases a JOIN countries c ON c.id = a.country_id
+            ''').fetchall())),
+            'university': PrefixIndex(),
+        }
+        self._rows = {}
+        for testimonial_id, *values in self._select(''):
+            self._rows[testimonial_id] = values
+            self._index(values, 1)
+
+    def _apply(self, testimonial_id):
+        old = self._rows.pop(testimonial_id, None)
+        if old:
+            self._index(old, -1)
+        row = self._select("AND id = ?", (testimonial_id,)).fetchone()
+        if row:
+            self._rows[testimonial_id] = values = [row['country'], row['university']]
+            self._index(values, 1)
+
+    def search(self, field, prefix, limit):
+        self.refresh()
+        with self._lock:
+            return self._indexes[field].search(prefix, limit)
+
+autocomplete_index = AutocompleteIndex(app.config['DATABASE'])
+
+# ------------------ Archive ------------------
+# Cold rows (old, or pending and never approved for a long time) live in a
+# separate database so the hot testimonials table and its indexes stay small.
+# Public pages only read the hot table; admin and export paths attach the
+# archive and read the all_testimonials view.
+
+def testimonial_columns(conn):
+    return [row[1] for row in conn.execute('PRAGMA main.table_info(testimonials)')]
+
+def ensure_archive_schema(conn):
+    """Create archive.testimonials, or add columns the hot table has gained."""
+    info = conn.execute('PRAGMA main.table_info(testimonials)').fetchall()
+    archived = {row[1] for row in conn.execute('PRAGMA archive.table_info(testimonials)')}
+    if not archived:
+        columns = ', '.join('id INTEGER PRIMARY KEY' if row[1] == 'id' else f'{row[1]} {row[2]}' for row in info)
+        conn.execute(f'CREATE TABLE archive.testimonials ({columns}, archived_at TIMESTAMP)')
+        conn.execute('CREATE INDEX archive.idx_archive_created ON testimonials (created_at)')
+        return
+    for row in info:
+        if row[1] not in archived:
+            conn.execute(f'ALTER TABLE archive.testimonials ADD COLUMN {row[1]} {row[2]}')
+
+def attach_archive(conn):
+    """ATTACH the archive and create the all_testimonials TEMP view.
+
+    A row present in both databases (an archive batch interrupted between
+    its copy and its delete) is reported once, from the hot table.
+    """
+    conn.execute('ATTACH DATABASE ? AS archive', (app.config['ARCHIVE_DATABASE'],))
+    ensure_archive_schema(conn)
+    columns = ', '.join(testimonial_columns(conn))
+    conn.execute(f'''
+        CREATE TEMP VIEW IF NOT EXISTS all_testimonials AS
+        SELECT {columns}, 0 AS is_archived FROM main.testimonials
+        UNION ALL
+        SELECT {columns}, 1 AS is_archived FROM archive.testimonials
+        WHERE id NOT IN (SELECT id FROM main.testimonials)
+    ''')
+
+def archive_testimonials(conn, max_age_days, pending_days, batch_size=500):
+    """Move cold testimonials into the attached archive; returns rows moved.
+
+    `conn` must be in autocommit mode with the archive attached. Each batch is
+    copied and then deleted in two short transactions (transactions across
+    attached WAL databases are not atomic): a crash in between leaves the
+    rows in both places, never in neither, and the next run finishes them.
+    Pending rows under a live moderation lease are left alone.
+    """
+    columns = ', '.join(testimonial_columns(conn))
+    where = '''
+        created_at < datetime('now', ?)
+        OR (is_approved = 0 AND created_at < datetime('now', ?)
+            AND (claimed_until IS NULL OR claimed_until <= datetime('now')))
+    '''
+    params = (f'-{max_age_days} days', f'-{pending_days} days')
+    moved = 0
+    while True:
+        ids = [row[0] for row in conn.execute(
+            f'SELECT id FROM main.testimonials WHERE {where} ORDER BY id LIMIT ?', (*params, batch_size))]
+        if not ids:
+            return moved
+        placeholders = ','.join('?' * len(ids))
+        with transaction(conn):
+            conn.execute(f'''
+                INSERT OR REPLACE INTO archive.testimonials ({columns}, archived_at)
+                SELECT {columns}, CURRENT_TIMESTAMP FROM main.testimonials WHERE id IN ({placeholders})
+            ''', ids)
+        with transaction(conn):
+            conn.execute(f'DELETE FROM main.testimonials WHERE id IN ({placeholders})', ids)
+            prune_change_log(conn)
+        moved += len(ids)
+
+# ------------------ Upload storage ------------------
+class LocalStorage:
+    """Uploads on local disk, sharded as <root>/ab/cd/<name> by a hash of the name.
+
+    Files from the old flat layout (<root>/<name>) are still found until
+    `flask migrate-uploads --from local --to local` moves them into shards.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def shard_path(self, name):
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], name)
+
+    def locate(self, name):
+        path = self.shard_path(name)
+        if not os.path.exists(path):
+            flat = os.path.join(self.root, name)
+            if os.path.isfile(flat):
+                return flat
+        return path
+
+    def save(self, stream, name):
+        path = self.shard_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(stream, f, 1024 * 1024)
+
+    def open(self, name):
+        return open(self.locate(name), 'rb')
+
+    def exists(self, name):
+        return os.path.isfile(self.locate(name))
+
+    def delete(self, name):
+        try:
+            os.remove(self.locate(name))
+        except FileNotFoundError:
+            pass
+
+    def names(self):
+        for _, _, files in os.walk(self.root):
+            yield from files
+
+    def reshard(self):
+        """Move files left in the flat layout into their shard directories."""
+        moved = 0
+        for entry in os.scandir(self.root):
+            if entry.is_file():
+                path = self.shard_path(entry.name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(entry.path, path)
+                moved += 1
+        return moved
+
+    def response(self, name):
+        path = self.locate(name)
+        return send_from_directory(os.path.dirname(path), name)
+
+class S3Storage:
+    """Uploads in an S3-compatible bucket (AWS, MinIO, ...); needs boto3.
+
+    Uploads stream through boto3's multipart transfer and downloads are
+    redirects to short-lived presigned URLs, so video bytes never pass
+    through the app server twice.
+    """
+
+    MULTIPART_CHUNK = 8 * 1024 * 1024
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, presign_seconds=3600):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.presign_seconds = presign_seconds
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None)
+        self.transfer = TransferConfig(multipart_threshold=self.MULTIPART_CHUNK,
+                                       multipart_chunksize=self.MULTIPART_CHUNK)
+
+    def key(self, name):
+        return self.prefix + name
+
+    def save(self, stream, name):
+        self.client.upload_fileobj(stream, self.bucket, self.key(name), Config=self.transfer)
+
+    def open(self, name):
+        return self.client.get_object(Bucket=self.bucket, Key=self.key(name))['Body']
+
+    def exists(self, name):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def names(self):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'][len(self.prefix):]
+
+    def response(self, name):
+        url = self.client.generate_presigned_url('get_object',
+                                                 Params={'Bucket': self.bucket, 'Key': self.key(name)},
+                                                 ExpiresIn=self.presign_seconds)
+        return redirect(url)
+
+def make_storage(kind):
+    if kind == 'local':
+        return LocalStorage(app.config['UPLOAD_FOLDER'])
+    if kind == 's3':
+        return S3Storage(app.config['S3_BUCKET'], prefix=app.config['S3_PREFIX'],
+                         endpoint_url=app.config['S3_ENDPOINT_URL'],
+                         presign_seconds=app.config['S3_PRESIGN_SECONDS'])
+    raise ValueError(f'Unknown upload storage: {kind}')
+
+upload_storage = make_storage(app.config['UPLOAD_STORAGE'])
+
 # ------------------ Authentication decorator ------------------
 def login_required(f):
     from functools import wraps
@@ -75,6 +1177,201 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# ------------------ Static assets ------------------
+# Logical asset name -> where it is served from until `flask build-assets`
+# has produced a local, content-hashed copy under static/build/.
+ASSET_SOURCES = {
+    'base.css': 'css/base.css',
+}
+VENDOR_ASSETS = {
+    'animate.css': 'https://cdnjs.cloudflare.com/ajax/libs/animate.css/4.1.1/animate.min.css',
+    'fontawesome.css': 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css',
+    'poppins.css': 'https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;500;600;700&display=swap',
+    'gsap.js': 'https://cdnjs.cloudflare.com/ajax/libs/gsap/3.11.4/gsap.min.js',
+    'chart.js': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.min.js',
+}
+ASSET_BUILD_DIR = os.path.join('static', 'build')
+ASSET_MANIFEST = os.path.join(ASSET_BUILD_DIR, 'manifest.json')
+
+def load_asset_manifest():
+    try:
+        with open(ASSET_MANIFEST, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'assets': {}, 'critical_css': ''}
+
+asset_manifest = load_asset_manifest()
+
+def asset_url(name):
+    built = asset_manifest['assets'].get(name)
+    if built:
+        return url_for('static', filename=built)
+    if name in ASSET_SOURCES:
+        return url_for('static', filename=ASSET_SOURCES[name])
+    return VENDOR_ASSETS[name]
+
+@app.context_processor
+def inject_assets():
+    return {'asset_url': asset_url, 'critical_css': asset_manifest['critical_css']}
+
+@app.after_request
+def cache_built_assets(response):
+    # build output is content-hashed, so it never changes under the same URL
+    if request.path.startswith('/static/build/') and response.status_code == 200:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+@app.before_request
+def require_schema():
+    # re-checked only while behind, so `flask migrate` takes effect without a restart
+    global schema_ready
+    if not schema_ready and request.endpoint != 'static':
+        schema_ready = verify_schema()
+        if not schema_ready:
+            return 'Base de dados em atualização, tenta novamente dentro de momentos.', 503
+
+# ------------------ Request profiling ------------------
+PROFILE_HEADER = 'X-Erasmus-Profile'
+PROFILE_TOKEN_MAX_AGE = 3600
+PROFILE_TOP_FUNCTIONS = 15
+PROFILE_NOT_SAMPLED = {'static', 'uploaded_file', 'admin_profiles', 'download_profile'}
+
+def profile_serializer():
+    return URLSafeTimedSerializer(app.secret_key, salt='request-profile')
+
+def profile_trigger():
+    """Why this request should be profiled ('header', 'flag', 'sample'), or None."""
+    token = request.headers.get(PROFILE_HEADER)
+    if token:
+        try:
+            profile_serializer().loads(token, max_age=PROFILE_TOKEN_MAX_AGE)
+            return 'header'
+        except BadSignature:
+            return None
+    if request.args.get('_profile') == '1' and session.get('is_admin'):
+        return 'flag'
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if rate and request.endpoint not in PROFILE_NOT_SAMPLED and random.random() < rate:
+        return 'sample'
+    return None
+
+def profile_category(filename, function):
+    if 'sqlite3' in function or 'sqlite3' in filename:
+        return 'sqlite'
+    # compiled templates keep the .html file as their code filename
+    if '/jinja2/' in filename or '/markupsafe/' in filename or filename.endswith('.html'):
+        return 'jinja'
+    return 'python'
+
+class RequestProfile:
+    """cProfile around one request, kept running until a streamed body is fully sent."""
+
+    def __init__(self, trigger):
+        self.meta = {'trigger': trigger, 'method': request.method, 'path': request.full_path.rstrip('?'),
+                     'endpoint': request.endpoint, 'started': datetime.now().isoformat(timespec='seconds')}
+        self.profiler = cProfile.Profile()
+        self.started = time.perf_counter()
+        self.finished = False
+        self.profiler.enable()
+
+    def finish(self, status=None):
+        if self.finished:
+            return
+        self.finished = True
+        self.profiler.disable()
+        self.meta['status'] = status
+        self.meta['duration_ms'] = round((time.perf_counter() - self.started) * 1000, 2)
+        try:
+            self.save()
+        except Exception:
+            app.logger.exception('Could not save request profile')
+
+    def summarize(self):
+        stats = pstats.Stats(self.profiler)
+        breakdown = {'sqlite': 0.0, 'jinja': 0.0, 'python': 0.0}
+        for (filename, _, function), (_, _, tottime, _, _) in stats.stats.items():
+            breakdown[profile_category(filename, function)] += tottime * 1000
+        top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        self.meta['breakdown_ms'] = {category: round(ms, 2) for category, ms in breakdown.items()}
+        self.meta['top'] = [
+            {'function': pstats.func_std_string(func), 'calls': calls,
+             'tottime_ms': round(tottime * 1000, 2), 'cumtime_ms': round(cumtime * 1000, 2)}
+            for func, (_, calls, tottime, cumtime, _) in top[:PROFILE_TOP_FUNCTIONS]
+        ]
+        return stats
+
+    def save(self):
+        directory = app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{self.meta['endpoint'] or 'unknown'}"
+        self.summarize().dump_stats(os.path.join(directory, name + '.pstats'))
+        with open(os.path.join(directory, name + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        for old in list_profiles()[app.config['PROFILE_KEEP']:]:
+            for ext in ('.pstats', '.json'):
+                try:
+                    os.remove(os.path.join(directory, old + ext))
+                except FileNotFoundError:
+                    pass
+
+def list_profiles():
+    """Saved profile names, newest first."""
+    try:
+        files = os.listdir(app.config['PROFILE_DIR'])
+    except FileNotFoundError:
+        return []
+    return sorted((f[:-len('.pstats')] for f in files if f.endswith('.pstats')), reverse=True)
+
+def start_request_profile():
+    trigger = profile_trigger()
+    if trigger:
+        try:
+            g.request_profile = RequestProfile(trigger)
+        except (RuntimeError, ValueError):
+            # another profiler is still active on this thread
+            app.logger.warning('Request profiling skipped: a profiler is already active')
+
+def attach_request_profile(response):
+    profile = g.pop('request_profile', None)
+    if profile:
+        status = response.status_code
+        response.call_on_close(lambda: profile.finish(status))
+    return response
+
+def abort_request_profile(exc):
+    profile = g.pop('request_profile', None)
+    if profile:
+        profile.finish(500)
+
+# with profiling off no hooks are installed at all
+if app.config['PROFILING']:
+    app.before_request(start_request_profile)
+    app.after_request(attach_request_profile)
+    app.teardown_request(abort_request_profile)
+
+@app.route('/admin/profiles')
+@login_required
+def admin_profiles():
+    profiles = []
+    for name in list_profiles():
+        try:
+            with open(os.path.join(app.config['PROFILE_DIR'], name + '.json'), encoding='utf-8') as f:
+                profiles.append(dict(json.load(f), name=name))
+        except (FileNotFoundError, ValueError):
+            continue
+    return render_template('admin_profiles.html', profiles=profiles, enabled=app.config['PROFILING'],
+                           sample_rate=app.config['PROFILE_SAMPLE_RATE'], header=PROFILE_HEADER,
+                           token=profile_serializer().dumps('profile'),
+                           token_minutes=PROFILE_TOKEN_MAX_AGE // 60)
+
+@app.route('/admin/profiles/<name>.pstats')
+@login_required
+def download_profile(name):
+    return send_from_directory(app.config['PROFILE_DIR'], name + '.pstats', as_attachment=True)
+
 # ------------------ Routes ------------------
 @app.route('/')
 def index():
@@ -92,74 +1389,100 @@ def europa():
 def cidadania():
     return render_template('cidadania.html')
 
+DEPOIMENTOS_PER_PAGE = 6
+DEPOIMENTOS_PER_PAGE_MAX = 1000
+
+DEPOIMENTOS_SHARED_MAX_AGE = 30  # seconds a shared (proxy) cache may serve a page without revalidating
+
+def get_data_version(conn):
+    return conn.execute('SELECT version FROM data_version WHERE id = 1').fetchone()[0]
+
+_render_version = None
+
+def render_version():
+    """Hash of the templates and built assets, so a deploy changes every ETag."""
+    global _render_version
+    if _render_version is None:
+        digest = hashlib.sha1(json.dumps(asset_manifest, sort_keys=True).encode('utf-8'))
+        templates_dir = os.path.join(app.root_path, 'templates')
+        for name in sorted(os.listdir(templates_dir)):
+            with open(os.path.join(templates_dir, name), 'rb') as f:
+                digest.update(f.read())
+        _render_version = digest.hexdigest()[:8]
+    return _render_version
+
+def listing_etag(version, role, *args):
+    key = '|'.join(str(arg) for arg in (render_version(), role) + args)
+    return f"{version}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+
+def cache_listing(response, etag, role):
+    response.set_etag(etag, weak=True)
+    response.vary.add('Cookie')
+    if role == 'public':
+        response.cache_control.public = True
+        response.cache_control.max_age = 0
+        response.cache_control.s_maxage = DEPOIMENTOS_SHARED_MAX_AGE
+    else:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
 @app.route('/depoimentos')
 def depoimentos():
-    page = request.args.get('page', 1, type=int)
-    per_page = 6
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = max(1, min(request.args.get('per_page', DEPOIMENTOS_PER_PAGE, type=int), DEPOIMENTOS_PER_PAGE_MAX))
     offset = (page - 1) * per_page
 
-    conn = get_db_connection()
-
     # Filters
     country_filter = request.args.get('country', '')
     year_filter = request.args.get('year', '')
     tag_filter = request.args.get('tag', '')
 
-    query = "SELECT * FROM testimonials WHERE is_approved = 1"
-    params = []
-    if country_filter:
-        query += " AND country = ?"
-        params.append(country_filter)
-    if year_filter:
-        query += " AND year = ?"
-        params.append(int(year_filter))
-    if tag_filter:
-        query += " AND tags LIKE ?"
-        params.append(f'%{tag_filter}%')
-
-    query += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
-    params.extend([per_page, offset])
-    testimonials = conn.execute(query, params).fetchall()
-
-    # total count
-    count_query = "SELECT COUNT(*) FROM testimonials WHERE is_approved = 1"
-    count_params = []
-    if country_filter:
-        count_query += " AND country = ?"
-        count_params.append(country_filter)
-    if year_filter:
-        count_query += " AND year = ?"
-        count_params.append(int(year_filter))
-    if tag_filter:
-        count_query += " AND tags LIKE ?"
-        count_params.append(f'%{tag_filter}%')
-
-    total_count = conn.execute(count_query, count_params).fetchone()[0]
+    # a streamed body is generated after the session is saved, so base.html could
+    # not consume a flash message there; such pages are buffered
+    stream = app.config['STREAM_TEMPLATES'] and '_flashes' not in session
+    conn = get_db_connection()
+    # revalidations are answered from the data version alone, before any listing query;
+    # pages carrying a flash message are never cached
+    etag = None
+    if '_flashes' not in session:
+        role = 'admin' if session.get('user_id') and session.get('is_admin') else 'public'
+        etag = listing_etag(get_data_version(conn), role, page, per_page, country_filter, year_filter, tag_filter)
+        if request.if_none_match.contains_weak(etag):
+            conn.close()
+            return cache_listing(app.response_class(status=304), etag, role)
+
+    fetch_page = read_model.fetch_page if app.config['READ_MODEL'] else fetch_testimonials_page
+    testimonials, total_count, countries, years, tags = fetch_page(
+        conn, country_filter, year_filter, tag_filter, per_page, offset, lazy=stream)
     total_pages = (total_count + per_page - 1) // per_page
 
-    # filters options
-    countries = conn.execute("SELECT DISTINCT country FROM testimonials WHERE is_approved = 1 ORDER BY country").fetchall()
-    years = conn.execute("SELECT DISTINCT year FROM testimonials WHERE is_approved = 1 ORDER BY year DESC").fetchall()
-
-    all_tags = conn.execute("SELECT tags FROM testimonials WHERE is_approved = 1 AND tags IS NOT NULL").fetchall()
-    tags_set = set()
-    for tag_row in all_tags:
-        if tag_row['tags']:
-            tags_set.update([t.strip() for t in tag_row['tags'].split(',')])
-    tags = sorted(tags_set)
-
-    conn.close()
+    context = dict(page=page,
+                   per_page=per_page,
+                   default_per_page=DEPOIMENTOS_PER_PAGE,
+                   total_pages=total_pages,
+                   countries=countries,
+                   years=years,
+                   tags=tags,
+                   current_country=country_filter,
+                   current_year=year_filter,
+                   current_tag=tag_filter)
+    if stream:
+        # head and filter bar go out first; cards follow as rows are read
+        response = app.response_class(
+            stream_template('depoimentos.html', testimonials=iter_and_close(testimonials, conn), **context))
+    else:
+        conn.close()
+        response = app.response_class(render_template('depoimentos.html', testimonials=testimonials, **context))
+    if etag:
+        cache_listing(response, etag, role)
+    return response
 
-    return render_template('depoimentos.html',
-                           testimonials=testimonials,
-                           page=page,
-                           total_pages=total_pages,
-                           countries=countries,
-                           years=years,
-                           tags=tags,
-                           current_country=country_filter,
-                           current_year=year_filter,
-                           current_tag=tag_filter)
+def iter_and_close(rows, conn):
+    try:
+        yield from rows
+    finally:
+        conn.close()
 
 @app.route('/dashboard')
 @login_required
@@ -170,10 +1493,10 @@ def dashboard():
     pending_testimonials = conn.execute("SELECT COUNT(*) FROM testimonials WHERE is_approved = 0").fetchone()[0]
 
     countries_data = conn.execute('''
-        SELECT country, COUNT(*) as count
-        FROM testimonials
-        WHERE is_approved = 1
-        GROUP BY country
+        SELECT c.name_pt as country, COUNT(*) as count
+        FROM testimonials t JOIN countries c ON c.id = t.country_id
+        WHERE t.is_approved = 1
+        GROUP BY t.country_id
         ORDER BY count DESC
     ''').fetchall()
 
@@ -235,49 +1558,139 @@ def admin_logout():
 @login_required
 def admin_testimonials():
     page = request.args.get('page', 1, type=int)
+    include_archive = request.args.get('include_archive', 0, type=int) == 1
     per_page = 10
     offset = (page - 1) * per_page
 
-    conn = get_db_connection()
-    testimonials = conn.execute('''
-        SELECT * FROM testimonials
+    conn = get_db_connection(include_archive=include_archive)
+    table = 'all_testimonials' if include_archive else 'testimonials'
+    testimonials = conn.execute(f'''
+        SELECT * FROM {table}
         ORDER BY created_at DESC
         LIMIT ? OFFSET ?
     ''', (per_page, offset)).fetchall()
 
-    total_count = conn.execute("SELECT COUNT(*) FROM testimonials").fetchone()[0]
+    total_count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
     total_pages = (total_count + per_page - 1) // per_page
 
     conn.close()
     return render_template('admin_testimonials.html',
                            testimonials=testimonials,
                            page=page,
-                           total_pages=total_pages)
+                           total_pages=total_pages,
+                           include_archive=include_archive)
+
+# ------------------ Moderation queue ------------------
+MODERATION_LEASE_SECONDS = 10 * 60
+MODERATION_BATCH_MAX = 50
+
+def claim_testimonials(conn, moderator_id, batch_size):
+    """Lease the next `batch_size` pending testimonials to a moderator.
+
+    One UPDATE ... RETURNING, so two moderators can never get the same row.
+    Rows whose lease has expired are free again; the moderator's own live
+    claims are renewed and returned too. The subquery walks the partial
+    idx_testimonials_pending index, so the cost is O(batch) regardless of
+    how many approved rows exist.
+    """
+    rows = conn.execute('''
+        UPDATE testimonials
+        SET claimed_by = ?, claimed_until = datetime('now', ?)
+        WHERE id IN (
+            SELECT id FROM testimonials INDEXED BY idx_testimonials_pending
+            WHERE is_approved = 0
+              AND (claimed_until IS NULL OR claimed_until <= datetime('now') OR claimed_by = ?)
+            ORDER BY created_at, id
+            LIMIT ?
+        )
+        RETURNING *
+    ''', (moderator_id, f'+{MODERATION_LEASE_SECONDS} seconds', moderator_id, batch_size)).fetchall()
+    conn.commit()
+    return sorted(rows, key=lambda row: (row['created_at'], row['id']))
+
+def held_by_other_moderator(conn, testimonial_id):
+    return conn.execute('''
+        SELECT 1 FROM testimonials
+        WHERE id = ? AND claimed_by != ? AND claimed_until > datetime('now')
+    ''', (testimonial_id, session['user_id'])).fetchone() is not None
+
+@app.route('/admin/queue')
+@login_required
+def admin_queue():
+    return render_template('admin_queue.html', lease_minutes=MODERATION_LEASE_SECONDS // 60)
+
+@app.route('/api/moderation/claim', methods=['POST'])
+@login_required
+def moderation_claim():
+    batch_size = max(1, min(request.args.get('batch', 10, type=int), MODERATION_BATCH_MAX))
+    conn = get_db_connection()
+    rows = claim_testimonials(conn, session['user_id'], batch_size)
+    conn.close()
+    fields = ('id', 'student_name', 'country', 'university', 'year', 'testimonial_text',
+              'video_url', 'video_file', 'tags', 'created_at', 'duplicate_of', 'claimed_until')
+    return jsonify({'success': True, 'testimonials': [{f: row[f] for f in fields} for row in rows]})
+
+@app.route('/api/moderation/release', methods=['POST'])
+@login_required
+def moderation_release():
+    conn = get_db_connection()
+    conn.execute('''
+        UPDATE testimonials SET claimed_by = NULL, claimed_until = NULL
+        WHERE claimed_by = ? AND is_approved = 0
+    ''', (session['user_id'],))
+    conn.commit()
+    conn.close()
+    return jsonify({'success': True})
 
 # ajax: approve / delete
 @app.route('/api/testimonial/approve/<int:testimonial_id>', methods=['POST'])
 @login_required
 def approve_testimonial(testimonial_id):
     conn = get_db_connection()
-    conn.execute('UPDATE testimonials SET is_approved = 1 WHERE id = ?', (testimonial_id,))
+    conn.execute('BEGIN IMMEDIATE')
+    if held_by_other_moderator(conn, testimonial_id):
+        conn.rollback()
+        conn.close()
+        return jsonify({'success': False, 'message': 'Depoimento reservado por outro moderador.'})
+    row = conn.execute('SELECT country FROM testimonials WHERE id = ?', (testimonial_id,)).fetchone()
+    # a country outside the known list joins it once a moderator has seen it
+    found = resolve_country(conn, row['country'], create=True) if row else None
+    country_id, country = found or (None, None)
+    conn.execute('''
+        UPDATE testimonials SET is_approved = 1, country_id = ?, country = COALESCE(?, country),
+                                claimed_by = NULL, claimed_until = NULL
+        WHERE id = ?
+    ''', (country_id, country, testimonial_id))
+    prune_change_log(conn)
     conn.commit()
     conn.close()
+    schedule_freeze()
     return jsonify({'success': True})
 
 @app.route('/api/testimonial/delete/<int:testimonial_id>', methods=['POST'])
 @login_required
 def delete_testimonial(testimonial_id):
     conn = get_db_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    if held_by_other_moderator(conn, testimonial_id):
+        conn.rollback()
+        conn.close()
+        return jsonify({'success': False, 'message': 'Depoimento reservado por outro moderador.'})
+    remove_testimonial(conn, testimonial_id)
+    prune_change_log(conn)
+    conn.commit()
+    conn.close()
+    schedule_freeze()
+    return jsonify({'success': True})
+
+def remove_testimonial(conn, testimonial_id):
     testimonial = conn.execute('SELECT video_file FROM testimonials WHERE id = ?', (testimonial_id,)).fetchone()
     if testimonial and testimonial['video_file']:
         try:
-            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], testimonial['video_file']))
+            upload_storage.delete(testimonial['video_file'])
         except Exception:
             pass
     conn.execute('DELETE FROM testimonials WHERE id = ?', (testimonial_id,))
-    conn.commit()
-    conn.close()
-    return jsonify({'success': True})
 
 # Add testimonial endpoint
 @app.route('/api/testimonial/add', methods=['POST'])
@@ -290,20 +1703,42 @@ def add_testimonial():
         testimonial_text = request.form['testimonial_text']
         video_url = request.form.get('video_url', '')
         tags = request.form.get('tags', '')
+        country = ' '.join(country.split())
+        if not country or len(country) > COUNTRY_MAX_LENGTH:
+            return jsonify({'success': False,
+                            'message': f'Indica o país (até {COUNTRY_MAX_LENGTH} caracteres).'})
+
+        exact_hash, signature = text_fingerprint(testimonial_text)
 
         video_filename = None
         if 'video_file' in request.files:
             video_file = request.files['video_file']
             if video_file and video_file.filename:
-                safe_name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{video_file.filename}"
-                video_file.save(os.path.join(app.config['UPLOAD_FOLDER'], safe_name))
+                safe_name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{secure_filename(video_file.filename)}"
+                upload_storage.save(video_file.stream, safe_name)
                 video_filename = safe_name
 
         conn = get_db_connection()
-        conn.execute('''
-            INSERT INTO testimonials (student_name, country, year, testimonial_text, video_url, video_file, tags)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (student_name, country, year, testimonial_text, video_url, video_filename, tags))
+        # check and insert under one write lock so a double submit cannot slip through
+        conn.execute('BEGIN IMMEDIATE')
+        # known spellings are stored under the canonical name; unknown countries wait
+        # for a moderator, approving the testimonial adds them
+        country_raw = country
+        country_id, country = resolve_country(conn, country) or (None, country)
+        duplicate_of, _, exact = find_duplicate(conn, exact_hash, signature)
+        if exact:
+            conn.rollback()
+            conn.close()
+            if video_filename:
+                upload_storage.delete(video_filename)
+            return jsonify({'success': False, 'message': 'Este depoimento já foi submetido.'})
+
+        cursor = conn.execute('''
+            INSERT INTO testimonials (student_name, country, country_id, country_raw, university, year, testimonial_text, video_url, video_file, tags, duplicate_of)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (student_name, country, country_id, country_raw, university, year, testimonial_text, video_url, video_filename, tags, duplicate_of))
+        store_fingerprint(conn, cursor.lastrowid, exact_hash, signature)
+        prune_change_log(conn)
         conn.commit()
         conn.close()
 
@@ -311,19 +1746,794 @@ def add_testimonial():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+AUTOCOMPLETE_LIMIT_MAX = 50
+
+@app.route('/api/autocomplete')
+def autocomplete():
+    field = request.args.get('field', '')
+    if field not in AutocompleteIndex.FIELDS:
+        return jsonify({'success': False, 'message': 'Campo inválido.'}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), AUTOCOMPLETE_LIMIT_MAX))
+    results = autocomplete_index.search(field, request.args.get('prefix', ''), limit)
+    return jsonify({'success': True, 'results': results})
+
 @app.route('/add_testimonial', methods=['POST'])
 def add_testimonial_route():
     return add_testimonial()
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return upload_storage.response(filename)
 
 # ------------------ Game route ------------------
+GAME_ROUNDS_MAX = 20
+GAME_LEADERBOARD_MAX = 50
+GAME_BATCH_TTL_HOURS = 24  # unscored batches older than this are dropped
+
 @app.route('/jogo')
 def jogo():
     return render_template('game.html')
 
+_flag_symbols = None
+
+def flag_symbols():
+    """{ISO code: (viewBox, markup)} of every flag in the committed sprite."""
+    global _flag_symbols
+    if _flag_symbols is None:
+        with open(FLAG_SPRITE, encoding='utf-8') as f:
+            svg = f.read()
+        _flag_symbols = {match.group(1).upper(): (match.group(2), match.group(3)) for match in re.finditer(
+            r'<symbol id="flag-([a-z]{2})" viewBox="([^"]+)">(.*?)</symbol>', svg, re.S)}
+    return _flag_symbols
+
+@app.route('/jogo/bandeiras/<batch_id>.svg')
+def game_flags(batch_id):
+    """The flags of one batch, named after their round, so ids mean nothing outside it."""
+    conn = get_db_connection()
+    rounds = conn.execute('SELECT round, country_code FROM game_rounds WHERE batch_id = ? ORDER BY round',
+                          (batch_id,)).fetchall()
+    conn.close()
+    if not rounds:
+        return 'Partida inválida.', 404
+    symbols = []
+    for row in rounds:
+        code, name = row['country_code'], f"r{row['round']}"
+        view_box, body = flag_symbols()[code]
+        body = body.replace(f'flag-{code.lower()}-', f'{name}-')
+        symbols.append(f'<symbol id="{name}" viewBox="{view_box}">{body}</symbol>')
+    response = app.response_class('<svg xmlns="http://www.w3.org/2000/svg">' + ''.join(symbols) + '</svg>',
+                                  mimetype='image/svg+xml')
+    response.cache_control.private = True
+    response.cache_control.max_age = GAME_BATCH_TTL_HOURS * 3600
+    return response
+
+def game_batch_totals(conn, batch_id):
+    return conn.execute('''
+        SELECT COALESCE(SUM(correct), 0) AS score, COUNT(correct) AS played
+        FROM game_rounds WHERE batch_id = ?
+    ''', (batch_id,)).fetchone()
+
+@app.route('/api/game/round')
+def game_round():
+    count = max(1, min(request.args.get('count', 10, type=int), GAME_ROUNDS_MAX))
+    batch_id = secrets.token_urlsafe(16)
+
+    conn = get_db_connection()
+    codes = [code for code in flag_countries(conn) if code in flag_symbols()]
+    codes = random.sample(codes, min(count, len(codes)))
+    with conn:
+        conn.execute(f"DELETE FROM game_rounds WHERE created_at < datetime('now', '-{GAME_BATCH_TTL_HOURS} hours')")
+        conn.executemany('INSERT INTO game_rounds (batch_id, round, country_code) VALUES (?, ?, ?)',
+                         [(batch_id, i, code) for i, code in enumerate(codes)])
+    conn.close()
+
+    sprite = url_for('game_flags', batch_id=batch_id)
+    return jsonify({'success': True,
+                    'batch': batch_id,
+                    'rounds': [{'round': i, 'flag': f'{sprite}#r{i}'} for i in range(len(codes))],
+                    'score': 0,
+                    'played': 0})
+
+@app.route('/api/game/guess', methods=['POST'])
+def game_guess():
+    data = request.get_json(silent=True) or request.form
+    batch_id = str(data.get('batch', ''))
+    try:
+        index = int(data.get('round', -1))
+    except (TypeError, ValueError):
+        index = -1
+
+    conn = get_db_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    row = conn.execute('''
+        SELECT country_code FROM game_rounds
+        WHERE batch_id = ? AND round = ? AND correct IS NULL
+          AND NOT EXISTS (SELECT 1 FROM game_scores WHERE batch_id = ?)
+    ''', (batch_id, index, batch_id)).fetchone()
+    if row is None:
+        conn.rollback()
+        conn.close()
+        return jsonify({'success': False, 'message': 'Ronda inválida.'})
+
+    code = row['country_code']
+    # any alias counts except the bare ISO code, which would give the answer away
+    correct = conn.execute('''
+        SELECT 1 FROM country_aliases a JOIN countries c ON c.id = a.country_id
+        WHERE a.alias = ? AND c.code = ? AND a.alias != lower(c.code)
+    ''', (normalize_name(str(data.get('guess', ''))), code)).fetchone() is not None
+    country = conn.execute('SELECT name_pt FROM countries WHERE code = ?', (code,)).fetchone()[0]
+    conn.execute('UPDATE game_rounds SET correct = ? WHERE batch_id = ? AND round = ?',
+                 (int(correct), batch_id, index))
+    totals = game_batch_totals(conn, batch_id)
+    conn.commit()
+    conn.close()
+    return jsonify({'success': True,
+                    'correct': correct,
+                    'country': country,
+                    'score': totals['score'],
+                    'played': totals['played']})
+
+@app.route('/api/game/score', methods=['POST'])
+def game_score():
+    data = request.get_json(silent=True) or request.form
+    player_name = str(data.get('player_name') or '').strip()[:40]
+    batch_id = str(data.get('batch', ''))
+    if not player_name:
+        return jsonify({'success': False, 'message': 'Escreve o teu nome.'})
+
+    conn = get_db_connection()
+    totals = game_batch_totals(conn, batch_id)
+    if not totals['played']:
+        conn.close()
+        return jsonify({'success': False, 'message': 'Joga pelo menos uma ronda.'})
+    try:
+        with conn:
+            conn.execute('INSERT INTO game_scores (player_name, score, rounds, batch_id) VALUES (?, ?, ?, ?)',
+                         (player_name, totals['score'], totals['played'], batch_id))
+    except sqlite3.IntegrityError:
+        conn.close()
+        return jsonify({'success': False, 'message': 'Esta partida já foi guardada.'})
+    rank = conn.execute('SELECT COUNT(*) FROM game_scores WHERE score > ?', (totals['score'],)).fetchone()[0] + 1
+    conn.close()
+    return jsonify({'success': True, 'rank': rank})
+
+@app.route('/api/game/leaderboard')
+def game_leaderboard():
+    limit = max(1, min(request.args.get('limit', 10, type=int), GAME_LEADERBOARD_MAX))
+    conn = get_db_connection()
+    scores = conn.execute('''
+        SELECT player_name, score, rounds, created_at
+        FROM game_scores
+        ORDER BY score DESC, created_at
+        LIMIT ?
+    ''', (limit,)).fetchall()
+    conn.close()
+    return jsonify({'success': True, 'scores': [dict(row) for row in scores]})
+
+# ------------------ Static freeze ------------------
+# Public pages rendered to FREEZE_DIR so a plain web server can answer them.
+# Listing pages live at depoimentos/country-<c>/year-<y>/tag-<t>/page-<n>.html
+# with url_for's query encoding, so nginx can map the raw $arg_* values:
+#
+#   gzip_static on;  brotli_static on;           # brotli_static needs ngx_brotli
+#   set $frozen /srv/erasmus/frozen;
+#   if ($cookie_session) { set $frozen /-; }     # admins and flash messages go to Flask
+#   if ($arg_per_page)   { set $frozen /-; }
+#   location = / { try_files $frozen/index.html @flask; }
+#   location ~ ^/(erasmus|europa|cidadania|jogo)$ { try_files $frozen$uri.html @flask; }
+#   location = /depoimentos {
+#       try_files $frozen/depoimentos/country-$arg_country/year-$arg_year/tag-$arg_tag/page-$arg_page.html @flask;
+#   }
+#
+# (with `root /` so $frozen is the full path). Anything not frozen falls through to Flask.
+FREEZE_PAGES = {'/': 'index.html', '/erasmus': 'erasmus.html', '/europa': 'europa.html',
+                '/cidadania': 'cidadania.html', '/jogo': 'jogo.html'}
+FREEZE_MANIFEST = '.freeze.json'
+
+def freeze_quote(value, form=False):
+    """Query-string encoding of a facet value as url_for (or a browser form) sends it."""
+    if form:
+        return quote_plus(str(value), safe='*').replace('~', '%7E')
+    return quote_plus(str(value), safe=',~*')
+
+class SiteFreezer:
+    """Render public pages through the app itself and write them with .gz/.br variants."""
+
+    def __init__(self, root):
+        self.root = root
+        self.client = app.test_client()
+        try:
+            import brotli
+        except ImportError:
+            brotli = None
+        self.brotli = brotli
+        self.written = 0
+        self.unchanged = 0
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def write(self, rel, body):
+        path = self.path(rel)
+        try:
+            with open(path, 'rb') as f:
+                if f.read() == body:
+                    self.unchanged += 1
+                    return
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        variants = [('', body), ('.gz', gzip.compress(body, 9, mtime=0))]
+        if self.brotli:
+            variants.append(('.br', self.brotli.compress(body)))
+        # compressed variants first so the plain file never pairs with stale ones
+        for suffix, data in reversed(variants):
+            tmp = f'{path}{suffix}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path + suffix)
+        self.written += 1
+
+    def symlink(self, rel, target):
+        path = self.path(rel)
+        if os.path.islink(path) and os.readlink(path) == target:
+            return
+        tmp = path + '.tmp'
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(target, tmp)
+        os.replace(tmp, path)
+
+    def render(self, url):
+        response = self.client.get(url)
+        body = response.get_data()
+        response.close()
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} answered {response.status_code}')
+        return body
+
+    def listing_dir(self, country, year, tag):
+        return os.path.join('depoimentos', f'country-{freeze_quote(country)}', f'year-{year}',
+                            f'tag-{freeze_quote(tag)}')
+
+    def freeze_listing(self, conn, country, year, tag):
+        _, total_count, _, _, _ = fetch_testimonials_page(conn, country, year, tag, 0, 0)
+        pages = max(1, (total_count + DEPOIMENTOS_PER_PAGE - 1) // DEPOIMENTOS_PER_PAGE)
+        directory = self.listing_dir(country, year, tag)
+        for page in range(1, pages + 1):
+            args = {'page': page, 'country': country, 'year': year, 'tag': tag}
+            self.write(os.path.join(directory, f'page-{page}.html'),
+                       self.render('/depoimentos?' + urlencode(args)))
+        # no page arg means page 1
+        self.symlink(os.path.join(directory, 'page-.html'), 'page-1.html')
+        for compressed in ('.gz', '.br'):
+            if os.path.exists(self.path(directory, 'page-1.html' + compressed)):
+                self.symlink(os.path.join(directory, 'page-.html' + compressed), 'page-1.html' + compressed)
+        self.remove_pages(directory, pages)
+        # the filter form encodes some characters differently from url_for
+        for prefix, value in (('country-', country), ('tag-', tag)):
+            if freeze_quote(value, form=True) != freeze_quote(value):
+                parent = os.path.dirname(directory) if prefix == 'tag-' else os.path.join('depoimentos')
+                self.symlink(os.path.join(parent, prefix + freeze_quote(value, form=True)),
+                             prefix + freeze_quote(value))
+
+    def remove_pages(self, directory, keep):
+        try:
+            names = os.listdir(self.path(directory))
+        except FileNotFoundError:
+            return
+        for name in names:
+            match = re.fullmatch(r'page-(\d+)\.html(\.gz|\.br)?', name)
+            if match and int(match.group(1)) > keep:
+                os.remove(self.path(directory, name))
+
+    def remove_listing(self, country, year, tag):
+        def unlink_dangling(parent, prefix, value):
+            link = self.path(parent, prefix + freeze_quote(value, form=True))
+            if os.path.islink(link) and not os.path.exists(link):
+                os.remove(link)
+
+        directory = self.listing_dir(country, year, tag)
+        shutil.rmtree(self.path(directory), ignore_errors=True)
+        unlink_dangling(os.path.dirname(directory), 'tag-', tag)
+        # drop year-/country- directories left empty
+        parent = os.path.dirname(directory)
+        while parent != 'depoimentos':
+            try:
+                os.rmdir(self.path(parent))
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+        unlink_dangling('depoimentos', 'country-', country)
+
+    def snapshot(self, conn):
+        rows = {}
+        # listings filter on the canonical name, whatever spelling the row was typed with
+        for row in conn.execute('''
+                SELECT t.id, COALESCE(c.name_pt, t.country) AS country, t.year, t.tags
+                FROM testimonials t LEFT JOIN countries c ON c.id = t.country_id
+                WHERE t.is_approved = 1
+        '''):
+            rows[str(row['id'])] = [row['country'], row['year'], row['tags'] or '']
+        countries = sorted({row[0] for row in rows.values()})
+        years = sorted({row[1] for row in rows.values()}, reverse=True)
+        tags = sorted({tag for row in rows.values() for tag in split_tags(row[2])})
+        return rows, countries, years, tags
+
+    @staticmethod
+    def listings(countries, years, tags):
+        keys = [('', '', '')]
+        keys += [(country, '', '') for country in countries]
+        keys += [('', year, '') for year in years]
+        keys += [('', '', tag) for tag in tags]
+        return keys
+
+    @staticmethod
+    def affected(facets, tags):
+        """Listings that show a row with these (country, year, tags)."""
+        country, year, row_tags = facets
+        keys = {('', '', ''), (country, '', ''), ('', year, '')}
+        # tag filters are LIKE '%tag%' on the raw tags column
+        keys.update(('', '', tag) for tag in tags if tag.lower() in row_tags.lower())
+        return keys
+
+    def load_manifest(self):
+        try:
+            with open(self.path(FREEZE_MANIFEST), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def freeze(self, incremental=False):
+        """Freeze the site; incremental re-renders only listings touched since the last run.
+
+        Returns the number of listings rendered.
+        """
+        conn = get_db_connection()
+        try:
+            seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM testimonial_changes').fetchone()[0]
+            rows, countries, years, tags = self.snapshot(conn)
+            manifest = self.load_manifest()
+            changes = read_changes(conn, manifest['seq']) if incremental and manifest else None
+            wanted = set(self.listings(countries, years, tags))
+            stale = {tuple(key) for key in manifest['listings']} - wanted if manifest else set()
+            if changes is None:
+                for url, name in FREEZE_PAGES.items():
+                    self.write(name, self.render(url))
+                todo = wanted
+            else:
+                old_rows = manifest['rows']
+                old_facets = (manifest['countries'], manifest['years'], manifest['tags'])
+                if old_facets != (countries, years, tags):
+                    # the filter bar on every listing page changes
+                    todo = set(wanted)
+                else:
+                    todo = set()
+                    for testimonial_id in map(str, changes[1]):
+                        for facets in (old_rows.get(testimonial_id), rows.get(testimonial_id)):
+                            if facets:
+                                todo |= self.affected(facets, tags)
+            for key in stale:
+                self.remove_listing(*key)
+            for key in sorted(todo & wanted, key=str):
+                self.freeze_listing(conn, *key)
+            manifest = {'seq': seq, 'countries': countries, 'years': years, 'tags': tags,
+                        'listings': sorted(wanted, key=str), 'rows': rows}
+            tmp = self.path(FREEZE_MANIFEST + '.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.replace(tmp, self.path(FREEZE_MANIFEST))
+            return len(todo & wanted)
+        finally:
+            conn.close()
+
+_freeze_lock = threading.Lock()
+_freeze_pending = threading.Event()
+
+def schedule_freeze():
+    """Re-freeze the affected pages in the background after an approve or delete."""
+    if not app.config['FREEZE_ON_CHANGE']:
+        return
+    _freeze_pending.set()
+    if _freeze_lock.acquire(blocking=False):
+        threading.Thread(target=_run_pending_freezes, daemon=True).start()
+
+def _run_pending_freezes():
+    while True:
+        try:
+            while _freeze_pending.is_set():
+                _freeze_pending.clear()
+                SiteFreezer(app.config['FREEZE_DIR']).freeze(incremental=True)
+        except Exception:
+            app.logger.exception('Incremental freeze failed')
+        finally:
+            _freeze_lock.release()
+        # a change may have arrived between the last check and the release
+        if not _freeze_pending.is_set() or not _freeze_lock.acquire(blocking=False):
+            return
+
+# ------------------ CLI commands ------------------
+@app.cli.command('migrate')
+@click.option('--to', 'target', type=int, help='Stop at this schema version.')
+def migrate_command(target):
+    """Apply pending schema migrations."""
+    version = migrate(target=target, echo=click.echo)
+    click.echo(f'Schema at version {version} (latest {SCHEMA_VERSION}).')
+
+def table_pages(conn, table):
+    """Pages used by a table and its indexes, or None without dbstat."""
+    try:
+        return conn.execute('''
+            SELECT COUNT(*) FROM dbstat('main')
+            WHERE name IN (SELECT name FROM main.sqlite_master WHERE tbl_name = ?)
+        ''', (table,)).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+def listing_latency_ms(database, repeat=20):
+    """Median time of the unfiltered /depoimentos queries."""
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fetch_testimonials_page(conn, '', '', '', 6, 0)
+        timings.append((time.perf_counter() - started) * 1000)
+    conn.close()
+    return statistics.median(timings)
+
+@app.cli.command('archive')
+@click.option('--max-age-days', default=5 * 365, show_default=True, help='Archive rows created before this.')
+@click.option('--pending-days', default=180, show_default=True,
+              help='Archive rows never approved (rejected) for this long.')
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--vacuum', is_flag=True, help='VACUUM afterwards to return freed pages (locks the database).')
+def archive_command(max_age_days, pending_days, batch_size, vacuum):
+    """Move cold testimonials into the archive database."""
+    database = app.config['DATABASE']
+    conn = sqlite3.connect(database, isolation_level=None)
+    conn.execute('ATTACH DATABASE ? AS archive', (app.config['ARCHIVE_DATABASE'],))
+    ensure_archive_schema(conn)
+
+    def stats():
+        rows = conn.execute('SELECT COUNT(*) FROM main.testimonials').fetchone()[0]
+        return rows, table_pages(conn, 'testimonials'), listing_latency_ms(database)
+
+    page_size = conn.execute('PRAGMA main.page_size').fetchone()[0]
+    rows_before, pages_before, latency_before = stats()
+    moved = archive_testimonials(conn, max_age_days, pending_days, batch_size)
+    if vacuum:
+        conn.execute('VACUUM main')
+    rows_after, pages_after, latency_after = stats()
+    conn.close()
+
+    click.echo(f'{moved} testimonials moved to {app.config["ARCHIVE_DATABASE"]}.')
+    click.echo(f'rows:    {rows_before} -> {rows_after}')
+    if pages_before is not None:
+        click.echo(f'pages:   {pages_before} -> {pages_after} '
+                   f'({pages_before * page_size // 1024} KB -> {pages_after * page_size // 1024} KB, table + indexes)')
+    click.echo(f'listing: {latency_before:.2f} ms -> {latency_after:.2f} ms (median, unfiltered page 1)')
+
+@app.cli.command('migrate-uploads')
+@click.option('--from', 'source_kind', type=click.Choice(['local', 's3']), default='local', show_default=True)
+@click.option('--to', 'target_kind', type=click.Choice(['local', 's3']), default='s3', show_default=True)
+@click.option('--delete-source', is_flag=True, help='Remove each file from the source once copied.')
+def migrate_uploads_command(source_kind, target_kind, delete_source):
+    """Copy uploaded videos between storage backends (local -> local reshards in place)."""
+    source = make_storage(source_kind)
+    if source_kind == target_kind == 'local':
+        click.echo(f'{source.reshard()} files moved into shard directories.')
+        return
+    target = make_storage(target_kind)
+    copied = skipped = 0
+    for name in list(source.names()):
+        if target.exists(name):
+            skipped += 1
+        else:
+            stream = source.open(name)
+            try:
+                target.save(stream, name)
+            finally:
+                stream.close()
+            copied += 1
+        if delete_source:
+            source.delete(name)
+    click.echo(f'{copied} files copied, {skipped} already present in {target_kind}.')
+
+@app.cli.command('export')
+@click.option('--include-archive', is_flag=True, help='Also export archived testimonials.')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', show_default=True)
+def export_command(include_archive, output):
+    """Write all testimonials as CSV."""
+    import csv
+
+    conn = get_db_connection(include_archive=include_archive)
+    table = 'all_testimonials' if include_archive else 'testimonials'
+    cursor = conn.execute(f'SELECT * FROM {table} ORDER BY id')
+    writer = csv.writer(output)
+    writer.writerow([column[0] for column in cursor.description])
+    for row in cursor:
+        writer.writerow(tuple(row))
+    conn.close()
+
+@app.cli.command('dedupe')
+@click.option('--delete', is_flag=True, help='Delete pending exact duplicates instead of flagging them.')
+@click.option('--batch-size', default=500, show_default=True)
+def dedupe_command(delete, batch_size):
+    """Fingerprint existing testimonials and flag (or delete) duplicates.
+
+    Rows are processed in id order and only compared with earlier rows, so
+    the oldest copy is always the one kept. Safe to re-run: rows that
+    already have a fingerprint are skipped.
+    """
+    conn = get_db_connection()
+    last_id, checked, flagged, deleted = 0, 0, 0, 0
+    while True:
+        rows = conn.execute('''
+            SELECT t.id, t.testimonial_text, t.is_approved
+            FROM testimonials t
+            LEFT JOIN testimonial_fingerprints f ON f.testimonial_id = t.id
+            WHERE t.id > ? AND f.testimonial_id IS NULL
+            ORDER BY t.id
+            LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            exact_hash, signature = text_fingerprint(row['testimonial_text'])
+            duplicate_of, similarity, exact = find_duplicate(conn, exact_hash, signature, before_id=row['id'])
+            if exact and delete and not row['is_approved']:
+                remove_testimonial(conn, row['id'])
+                deleted += 1
+                continue
+            store_fingerprint(conn, row['id'], exact_hash, signature)
+            if duplicate_of:
+                conn.execute('UPDATE testimonials SET duplicate_of = ? WHERE id = ?', (duplicate_of, row['id']))
+                flagged += 1
+        checked += len(rows)
+        last_id = rows[-1]['id']
+        prune_change_log(conn)
+        conn.commit()
+    conn.close()
+    click.echo(f'{checked} testimonials fingerprinted, {flagged} flagged as duplicates, {deleted} deleted.')
+
+# Above-the-fold selectors inlined into every page by build-assets
+CRITICAL_CSS_SELECTORS = (':root', '*', 'html', 'body', '.navbar', '.nav-container', '.nav-links',
+                          '.logo', '.main-content', '.hero', '.btn', '.btn-secondary', '.btn-accent',
+                          '.card')
+FETCH_USER_AGENT = ('Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+                    '(KHTML, like Gecko) Chrome/120.0 Safari/537.36')  # gets woff2 from Google Fonts
+
+def fetch_url(url):
+    import urllib.request
+    req = urllib.request.Request(url, headers={'User-Agent': FETCH_USER_AGENT})
+    with urllib.request.urlopen(req, timeout=30) as res:
+        return res.read()
+
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+def split_css_rules(css):
+    """Split minified CSS into top-level (prelude, body) pairs."""
+    rules, depth, start, prelude = [], 0, 0, ''
+    for i, ch in enumerate(css):
+        if ch == '{':
+            if depth == 0:
+                prelude, start = css[start:i], i + 1
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                rules.append((prelude, css[start:i]))
+                start = i + 1
+    return rules
+
+def join_css_rules(rules):
+    return ''.join(f'{prelude}{{{body}}}' for prelude, body in rules)
+
+def is_critical_selector(selector):
+    return any(selector == s or selector.startswith((s + ' ', s + ':', s + '.', s + ','))
+               for s in CRITICAL_CSS_SELECTORS)
+
+def critical_css_rules(rules):
+    critical = []
+    for prelude, body in rules:
+        if prelude.startswith('@media'):
+            inner = critical_css_rules(split_css_rules(body))
+            if inner:
+                critical.append((prelude, join_css_rules(inner)))
+        elif not prelude.startswith('@') and all(is_critical_selector(s) for s in prelude.split(',')):
+            critical.append((prelude, body))
+    return critical
+
+def used_icons(templates_dir='templates'):
+    icons = set()
+    for name in os.listdir(templates_dir):
+        with open(os.path.join(templates_dir, name), encoding='utf-8') as f:
+            icons.update(re.findall(r'\bfa-([a-z0-9-]+)', f.read()))
+    return icons
+
+def subset_font(data, codepoints):
+    """Keep only `codepoints` in a woff2 font; needs fonttools + brotli."""
+    import io
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+
+    font = TTFont(io.BytesIO(data))
+    options = subset.Options()
+    options.flavor = 'woff2'
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=codepoints)
+    subsetter.subset(font)
+    out = io.BytesIO()
+    font.save(out)
+    return out.getvalue()
+
+class AssetBuilder:
+    """Writes content-hashed files into static/build and records them."""
+
+    def __init__(self, build_dir=ASSET_BUILD_DIR):
+        self.build_dir = build_dir
+        self.assets = {}
+        self._fetched = {}
+        os.makedirs(build_dir, exist_ok=True)
+
+    def write(self, stem, ext, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        name = f'{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}'
+        with open(os.path.join(self.build_dir, name), 'wb') as f:
+            f.write(data)
+        return name
+
+    def fetch(self, url):
+        if url not in self._fetched:
+            self._fetched[url] = fetch_url(url)
+        return self._fetched[url]
+
+    def vendor_urls(self, css, css_url, rewrite=None):
+        """Download every url(...) in `css` next to it and point at the copies."""
+        from urllib.parse import urljoin
+
+        def replace(match):
+            ref = match.group(1).strip('\'"')
+            if ref.startswith('data:'):
+                return match.group(0)
+            url = urljoin(css_url, ref)
+            data = self.fetch(url)
+            if rewrite:
+                data = rewrite(data)
+            stem, ext = os.path.splitext(os.path.basename(url.split('?')[0]))
+            return f'url({self.write(stem, ext, data)})'
+
+        return re.sub(r'url\(([^)]+)\)', replace, css)
+
+    def build_fontawesome(self, css, css_url, icons):
+        """Drop icon rules the templates never use and subset the fonts to match."""
+        rules, codepoints = [], set()
+        for prelude, body in split_css_rules(css):
+            icon_selectors = [re.fullmatch(r'\.fa-([a-z0-9-]+)::?before', s) for s in prelude.split(',')]
+            if all(icon_selectors) and body.startswith('content:'):
+                used = [m.group(0) for m in icon_selectors if m.group(1) in icons]
+                if not used:
+                    continue
+                prelude = ','.join(used)
+                codepoints.update(int(cp, 16) for cp in re.findall(r'\\([0-9a-fA-F]+)', body))
+            elif prelude == '@font-face':
+                # woff2 only: every browser that runs this site supports it
+                body = re.sub(r'src:[^;}]*?(url\([^)]*?\.woff2\)[^,;}]*)[^;}]*', r'src:\1', body)
+            rules.append((prelude, body))
+
+        try:
+            import fontTools  # noqa: F401
+            rewrite = lambda data: subset_font(data, codepoints)
+        except ImportError:
+            click.echo('  fonttools not installed, icon fonts copied without subsetting')
+            rewrite = None
+        return self.vendor_urls(join_css_rules(rules), css_url, rewrite)
+
+    def build(self, source_dir='static', vendor=True):
+        with open(os.path.join(source_dir, ASSET_SOURCES['base.css']), encoding='utf-8') as f:
+            base_css = minify_css(f.read())
+        self.assets['base.css'] = self.write('base', '.css', base_css)
+        critical_css = join_css_rules(critical_css_rules(split_css_rules(base_css)))
+
+        for name, url in VENDOR_ASSETS.items() if vendor else ():
+            stem, ext = os.path.splitext(name)
+            try:
+                data = self.fetch(url)
+                if ext == '.css':
+                    css = minify_css(data.decode('utf-8'))
+                    if name == 'fontawesome.css':
+                        css = self.build_fontawesome(css, url, used_icons())
+                    else:
+                        css = self.vendor_urls(css, url)
+                    data = css
+                self.assets[name] = self.write(stem, ext, data)
+            except OSError as e:
+                click.echo(f'  {name}: could not vendor ({e}), pages keep using the CDN')
+
+        manifest = {'assets': {name: f'build/{path}' for name, path in self.assets.items()},
+                    'critical_css': critical_css}
+        with open(os.path.join(self.build_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+FLAG_SPRITE = os.path.join('static', 'img', 'flags.svg')
+TWEMOJI_FLAG_VIEWBOX = '0 5 36 26'  # the flag itself inside Twemoji's 36x36 emoji box
+
+def flag_symbol(code, svg, view_box):
+    """One flag SVG as a <symbol>, its internal ids prefixed so flags can share a sprite."""
+    body = re.search(r'<svg[^>]*>(.*)</svg>', svg, re.S).group(1).strip()
+    prefix = f'flag-{code}-'
+    body = re.sub(r'\bid="([^"]+)"', lambda m: f'id="{prefix}{m.group(1)}"', body)
+    body = re.sub(r'(href="|url\()#', lambda m: f'{m.group(1)}#{prefix}', body)
+    return f'<symbol id="flag-{code}" viewBox="{view_box}">{body}</symbol>'
+
+def twemoji_name(code):
+    """Twemoji file name of a country's flag: its two regional indicator code points."""
+    return '-'.join(f'{0x1F1E6 + ord(letter) - ord("A"):x}' for letter in code.upper()) + '.svg'
+
+@app.cli.command('build-flag-sprite')
+@click.argument('source', type=click.Path(exists=True, file_okay=False))
+def build_flag_sprite(source):
+    """Rebuild static/img/flags.svg from a directory of Twemoji SVGs (assets/svg).
+
+    Covers every country in the countries table that has an ISO code.
+    """
+    conn = get_db_connection()
+    try:
+        codes = flag_countries(conn)
+    except sqlite3.OperationalError as e:
+        raise click.ClickException(f'{e} (run `flask migrate` first)')
+    finally:
+        conn.close()
+    symbols = []
+    for code in sorted(codes):
+        with open(os.path.join(source, twemoji_name(code)), encoding='utf-8') as f:
+            symbols.append(flag_symbol(code.lower(), f.read(), TWEMOJI_FLAG_VIEWBOX))
+    os.makedirs(os.path.dirname(FLAG_SPRITE), exist_ok=True)
+    with open(FLAG_SPRITE, 'w', encoding='utf-8') as f:
+        f.write('<svg xmlns="http://www.w3.org/2000/svg">\n'
+                '<!-- Flags from Twemoji, https://github.com/jdecked/twemoji\n'
+                '     Copyright Twitter, Inc. and other contributors, licensed under CC-BY 4.0:\n'
+                '     https://creativecommons.org/licenses/by/4.0/ -->\n'
+                + '\n'.join(symbols) + '\n</svg>\n')
+    click.echo(f'{len(symbols)} flags written to {FLAG_SPRITE} ({os.path.getsize(FLAG_SPRITE) / 1024:.1f} KB)')
+
+@app.cli.command('build-assets')
+@click.option('--no-vendor', is_flag=True, help='Only build our own CSS, keep CDN assets.')
+def build_assets(no_vendor):
+    """Build static/build: hashed CSS, critical CSS and vendored CDN assets.
+
+    Run at deploy/build time (it needs network access to vendor); install
+    fonttools and brotli to subset the icon font.
+    """
+    global asset_manifest
+    shutil.rmtree(ASSET_BUILD_DIR, ignore_errors=True)
+    builder = AssetBuilder()
+    asset_manifest = builder.build(vendor=not no_vendor)
+    for name, path in sorted(asset_manifest['assets'].items()):
+        size = os.path.getsize(os.path.join('static', path))
+        click.echo(f'{name:<16} {path} ({size / 1024:.1f} KB)')
+    click.echo(f"critical css     inlined ({len(asset_manifest['critical_css']) / 1024:.1f} KB)")
+
+@app.cli.command('freeze')
+@click.option('--incremental', is_flag=True,
+              help='Only re-render listings touched by approvals/deletions since the last freeze.')
+@click.option('--output', default=None, help='Output directory (default: FREEZE_DIR).')
+def freeze_command(incremental, output):
+    """Render the public pages into a static tree with .gz/.br variants."""
+    freezer = SiteFreezer(output or app.config['FREEZE_DIR'])
+    started = time.perf_counter()
+    listings = freezer.freeze(incremental=incremental)
+    click.echo(f'{listings} listings rendered: {freezer.written} files written, {freezer.unchanged} unchanged '
+               f'in {time.perf_counter() - started:.1f}s'
+               + ('' if freezer.brotli else ' (brotli not installed, .br skipped)'))
+
 # ------------------ Template generator ------------------
 def create_templates():
     templates_dir = 'templates'
@@ -337,91 +2547,19 @@ def create_templates():
     <meta charset="utf-8">
     <meta name="viewport" content="width=device-width,initial-scale=1">
     <title>Erasmus+ - Portal Digital</title>
-    <link href="https://cdnjs.cloudflare.com/ajax/libs/animate.css/4.1.1/animate.min.css" rel="stylesheet">
-    <link href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css" rel="stylesheet">
-    <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;500;600;700&display=swap" rel="stylesheet">
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/gsap/3.11.4/gsap.min.js"></script>
-    <style>
-        :root {
-            --primary: #0066FF;      /* Azul Erasmus */
-            --secondary: #FFCC00;    /* Amarelo UE */
-            --accent: #00C9A7;       /* Verde moderno */
-            --light: #F4F6F9;
-            --dark: #1B1F3B;
-            --success: #2ECC71;
-            --warning: #F39C12;
-            --danger: #E74C3C;
-        }
-
-        * { box-sizing: border-box; }
-        html,body { height: 100%; margin: 0; font-family: 'Poppins', sans-serif; background: linear-gradient(135deg,#e9f2ff 0%, #f7fbff 100%); color: var(--dark); }
-
-        .navbar {
-            background: white;
-            box-shadow: 0 6px 20px rgba(24,39,75,0.06);
-            position: sticky;
-            top: 0;
-            z-index: 1000;
-        }
-        .nav-container { max-width: 1200px; margin: 0 auto; padding: 0.75rem 1rem; display:flex; align-items:center; justify-content:space-between; gap:1rem; }
-        .logo { font-weight:700; color:var(--dark); text-decoration:none; font-size:1.4rem; }
-        .logo span { color: var(--primary); }
-        .nav-links { list-style:none; display:flex; gap:1rem; margin:0; padding:0; align-items:center;}
-        .nav-links a { text-decoration:none; color:var(--dark); padding:0.5rem 0.75rem; border-radius:8px; font-weight:500; }
-        .nav-links a:hover { background: rgba(0,0,0,0.04); color:var(--primary); }
-        .nav-links a.active { background: linear-gradient(90deg,var(--primary), #2b8bff); color:white; }
-
-        .main-content { padding: 2rem 1rem; max-width:1200px; margin: 0 auto; min-height: calc(100vh - 80px); }
-
-        .hero { text-align:center; padding: 3rem 1rem; }
-        .hero h1 { font-size:2.6rem; margin-bottom:0.5rem; color:var(--dark); }
-        .hero p { color: #51607a; margin-bottom:1rem; }
-
-        .btn {
-            background: var(--primary);
-            color: white;
-            padding: 0.6rem 1rem;
-            border-radius: 999px;
-            border: none;
-            cursor: pointer;
-            font-weight:600;
-            text-decoration: none;
-            display:inline-block;
-        }
-        .btn:hover { transform: translateY(-3px); box-shadow: 0 8px 20px rgba(0,102,255,0.12); }
-
-        .btn-secondary { background: var(--secondary); color: var(--dark); }
-        .btn-accent { background: var(--accent); color: white; }
-
-        .card {
-            background: white;
-            border-radius: 12px;
-            padding: 1.25rem;
-            box-shadow: 0 8px 28px rgba(31,45,80,0.06);
-            margin-bottom: 1.25rem;
-        }
-
-        .testimonial-grid { display:grid; grid-template-columns: repeat(auto-fit, minmax(280px,1fr)); gap:1rem; margin-top:1rem; }
-        .testimonial-card { padding:1rem; border-radius:10px; background: linear-gradient(180deg, rgba(255,255,255,1), rgba(250,252,255,1)); border: 1px solid rgba(15,23,42,0.03); }
-
-        .filter-select { padding:0.5rem 0.75rem; border-radius: 999px; border:1px solid rgba(15,23,42,0.06); background: white; }
-
-        .form-control { width:100%; padding:0.65rem 0.9rem; border-radius:8px; border:1px solid rgba(15,23,42,0.06); background:white; }
-
-        .video-container { border-radius:10px; overflow:hidden; margin-bottom:0.75rem; background:#000; display:block; }
-
-        .flash-messages { position: fixed; top: 80px; right: 20px; z-index: 2000; }
-        .flash-message { padding: 0.85rem 1rem; border-radius:8px; margin-bottom:0.5rem; box-shadow: 0 6px 20px rgba(8,15,30,0.06); }
-        .flash-success { background: rgba(46,204,113,0.12); border:1px solid rgba(46,204,113,0.18); }
-        .flash-error { background: rgba(231,76,60,0.08); border:1px solid rgba(231,76,60,0.12); }
-
-        .stats-grid { display:grid; grid-template-columns: repeat(auto-fit, minmax(180px,1fr)); gap:1rem; }
-
-        @media (max-width: 768px) {
-            .nav-links { display:none; }
-            .nav-container { justify-content:space-between; }
-        }
-    </style>
+    {% if critical_css %}<style>{{ critical_css|safe }}</style>{% endif %}
+    <link href="{{ asset_url('base.css') }}" rel="stylesheet"{% if critical_css %} media="print" onload="this.media='all'"{% endif %}>
+    <link href="{{ asset_url('poppins.css') }}" rel="stylesheet" media="print" onload="this.media='all'">
+    <link href="{{ asset_url('fontawesome.css') }}" rel="stylesheet" media="print" onload="this.media='all'">
+    <link href="{{ asset_url('animate.css') }}" rel="stylesheet" media="print" onload="this.media='all'">
+    <noscript>
+        <link href="{{ asset_url('base.css') }}" rel="stylesheet">
+        <link href="{{ asset_url('poppins.css') }}" rel="stylesheet">
+        <link href="{{ asset_url('fontawesome.css') }}" rel="stylesheet">
+        <link href="{{ asset_url('animate.css') }}" rel="stylesheet">
+    </noscript>
+    <script defer src="{{ asset_url('gsap.js') }}"></script>
+    {% block head %}{% endblock %}
 </head>
 <body>
     <nav class="navbar">
@@ -460,8 +2598,8 @@ def create_templates():
     </div>
 
     <script>
-        // small animations
-        gsap.from('.nav-container', {duration:0.8, y:-20, opacity:0});
+        // small animations (gsap is deferred)
+        document.addEventListener('DOMContentLoaded', () => gsap.from('.nav-container', {duration:0.8, y:-20, opacity:0}));
     </script>
     {% block scripts %}{% endblock %}
 </body>
@@ -588,6 +2726,7 @@ def create_templates():
     <div class="card">
         <h3>Filtrar Depoimentos</h3>
         <form method="GET" class="card" style="display:flex; gap:0.5rem; flex-wrap:wrap; align-items:center;">
+            {% if per_page != default_per_page %}<input type="hidden" name="per_page" value="{{ per_page }}">{% endif %}
             <select name="country" class="filter-select" onchange="this.form.submit()">
                 <option value="">Todos os Países</option>
                 {% for country in countries %}
@@ -619,8 +2758,8 @@ def create_templates():
         <form id="addTestimonialForm" enctype="multipart/form-data">
             <div style="display:grid; grid-template-columns:repeat(auto-fit,minmax(220px,1fr)); gap:0.75rem;">
                 <div><label>Nome</label><input class="form-control" name="student_name" required></div>
-                <div><label>País</label><input class="form-control" name="country" required></div>
-                <div><label>Universidade</label><input class="form-control" name="university" required></div>
+                <div><label>País</label><input class="form-control" name="country" list="countrySuggestions" autocomplete="off" required></div>
+                <div><label>Universidade</label><input class="form-control" name="university" list="universitySuggestions" autocomplete="off" required></div>
                 <div><label>Ano</label><input type="number" min="1987" max="2026" class="form-control" name="year" required></div>
             </div>
             <div style="margin-top:0.75rem;">
@@ -638,6 +2777,8 @@ def create_templates():
             <div style="margin-top:0.75rem;">
                 <button type="submit" class="btn btn-accent">Submeter Depoimento</button>
             </div>
+            <datalist id="countrySuggestions"></datalist>
+            <datalist id="universitySuggestions"></datalist>
         </form>
     </div>
 
@@ -697,13 +2838,35 @@ def create_templates():
     {% if total_pages > 1 %}
     <div style="text-align:center; margin-top:1rem;">
         {% for p in range(1, total_pages+1) %}
-            <a href="{{ url_for('depoimentos', page=p, country=current_country, year=current_year, tag=current_tag) }}" class="btn" style="margin:0.25rem;">{{ p }}</a>
+            <a href="{{ url_for('depoimentos', page=p, country=current_country, year=current_year, tag=current_tag, per_page=per_page if per_page != default_per_page else None) }}" class="btn" style="margin:0.25rem;">{{ p }}</a>
         {% endfor %}
     </div>
     {% endif %}
 </div>
 
 <script>
+// suggest existing spellings so the same country/university is not typed five ways
+['country', 'university'].forEach(field => {
+    const input = document.querySelector(`#addTestimonialForm [name="${field}"]`);
+    const list = document.getElementById(`${field}Suggestions`);
+    let timer = null;
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(async () => {
+            try {
+                const res = await fetch(`/api/autocomplete?field=${field}&prefix=${encodeURIComponent(input.value)}`);
+                const r = await res.json();
+                list.innerHTML = '';
+                (r.results || []).forEach(item => {
+                    const option = document.createElement('option');
+                    option.value = item.value;
+                    list.appendChild(option);
+                });
+            } catch (err) { /* suggestions are optional */ }
+        }, 150);
+    });
+});
+
 document.getElementById('addTestimonialForm').addEventListener('submit', async function(e){
     e.preventDefault();
     const fd = new FormData(this);
@@ -755,7 +2918,9 @@ document.getElementById('addTestimonialForm').addEventListener('submit', async f
     <div class="card" style="margin-top:1rem;">
         <h3>Ações Rápidas</h3>
         <div style="display:flex; gap:0.5rem; flex-wrap:wrap;">
+            <a href="{{ url_for('admin_queue') }}" class="btn btn-accent">Fila de Moderação</a>
             <a href="{{ url_for('admin_testimonials') }}" class="btn">Gerir Depoimentos</a>
+            <a href="{{ url_for('admin_profiles') }}" class="btn">Perfis de Pedidos</a>
             <a href="{{ url_for('depoimentos') }}" class="btn btn-secondary">Ver Site Público</a>
             <a href="{{ url_for('admin_logout') }}" class="btn" style="background:var(--danger);">Logout</a>
         </div>
@@ -778,8 +2943,9 @@ document.getElementById('addTestimonialForm').addEventListener('submit', async f
     </div>
 </div>
 
-<script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
+<script defer src="{{ asset_url('chart.js') }}"></script>
 <script>
+document.addEventListener('DOMContentLoaded', () => {
 const countriesLabels = [{% for c in countries_data %}'{{ c.country }}',{% endfor %}];
 const countriesValues = [{% for c in countries_data %}{{ c.count }},{% endfor %}];
 
@@ -799,6 +2965,7 @@ const monthsLabels = [{% for m in monthly_data %}'{{ m.month }}',{% endfor %}];
 const monthsValues = [{% for m in monthly_data %}{{ m.count }},{% endfor %}];
 const ctx3 = document.getElementById('monthlyChart').getContext('2d');
 new Chart(ctx3, { type:'bar', data:{ labels:monthsLabels, datasets:[{ label:'Submissões', data:monthsValues }]}, options:{ responsive:true }});
+});
 </script>
 {% endblock %}''')
 
@@ -839,8 +3006,13 @@ new Chart(ctx3, { type:'bar', data:{ labels:monthsLabels, datasets:[{ label:'Sub
 </div>
 
 <div class="main-content">
-    <div class="card">
+    <div class="card" style="display:flex; gap:0.5rem; flex-wrap:wrap;">
         <a href="{{ url_for('dashboard') }}" class="btn btn-secondary">Voltar ao Dashboard</a>
+        {% if include_archive %}
+        <a href="{{ url_for('admin_testimonials') }}" class="btn">Esconder arquivo</a>
+        {% else %}
+        <a href="{{ url_for('admin_testimonials', include_archive=1) }}" class="btn">Incluir arquivo</a>
+        {% endif %}
     </div>
 
     <div style="display:grid; gap:1rem;">
@@ -849,19 +3021,27 @@ new Chart(ctx3, { type:'bar', data:{ labels:monthsLabels, datasets:[{ label:'Sub
             <div style="display:flex; justify-content:space-between; align-items:center;">
                 <div><h4>{{ testimonial.student_name }}</h4><small>{{ testimonial.university }} — {{ testimonial.country }} ({{ testimonial.year }})</small></div>
                 <div>
+                    {% if testimonial.is_archived %}
+                    <span style="padding:0.3rem 0.55rem; border-radius:12px; background:var(--dark); color:white;">Arquivado</span>
+                    {% endif %}
                     <span style="padding:0.3rem 0.55rem; border-radius:12px; background:{% if testimonial.is_approved %}var(--success){% else %}var(--warning){% endif %}; color:white;">
                         {% if testimonial.is_approved %}Aprovado{% else %}Pendente{% endif %}
                     </span>
                 </div>
             </div>
             <p style="margin-top:0.5rem;">{{ testimonial.testimonial_text }}</p>
+            {% if testimonial.duplicate_of %}
+            <small style="color:var(--warning);">Possível duplicado do depoimento #{{ testimonial.duplicate_of }}</small>
+            {% endif %}
 
+            {% if not testimonial.is_archived %}
             <div style="display:flex; gap:0.5rem; margin-top:0.75rem;">
                 {% if not testimonial.is_approved %}
                 <button class="btn" onclick="approveTestimonial({{ testimonial.id }})">Aprovar</button>
                 {% endif %}
                 <button class="btn" style="background:var(--danger);" onclick="deleteTestimonial({{ testimonial.id }})">Remover</button>
             </div>
+            {% endif %}
         </div>
         {% else %}
         <div class="card">Nenhum depoimento encontrado</div>
@@ -871,7 +3051,7 @@ new Chart(ctx3, { type:'bar', data:{ labels:monthsLabels, datasets:[{ label:'Sub
     {% if total_pages > 1 %}
     <div style="text-align:center; margin-top:1rem;">
         {% for p in range(1, total_pages+1) %}
-        <a href="{{ url_for('admin_testimonials', page=p) }}" class="btn" style="margin:0.25rem;">{{ p }}</a>
+        <a href="{{ url_for('admin_testimonials', page=p, include_archive=1 if include_archive else None) }}" class="btn" style="margin:0.25rem;">{{ p }}</a>
         {% endfor %}
     </div>
     {% endif %}
@@ -883,7 +3063,7 @@ async function approveTestimonial(id){
     try {
         const res = await fetch(`/api/testimonial/approve/${id}`, { method:'POST' });
         const r = await res.json();
-        if(r.success) { location.reload(); } else alert('Erro ao aprovar');
+        if(r.success) { location.reload(); } else alert(r.message || 'Erro ao aprovar');
     } catch(e){ alert('Erro de rede'); }
 }
 async function deleteTestimonial(id){
@@ -891,9 +3071,138 @@ async function deleteTestimonial(id){
     try {
         const res = await fetch(`/api/testimonial/delete/${id}`, { method:'POST' });
         const r = await res.json();
-        if(r.success) { document.getElementById('testimonial-'+id).remove(); } else alert('Erro ao remover');
+        if(r.success) { document.getElementById('testimonial-'+id).remove(); } else alert(r.message || 'Erro ao remover');
+    } catch(e){ alert('Erro de rede'); }
+}
+</script>
+{% endblock %}''')
+
+    # ---------- admin_profiles.html ----------
+    with open(os.path.join(templates_dir, 'admin_profiles.html'), 'w', encoding='utf-8') as f:
+        f.write(r'''{% extends "base.html" %}
+{% block content %}
+<div class="hero">
+    <h1>Perfis de Pedidos</h1>
+    <p>cProfile de pedidos lentos, com o tempo repartido entre SQLite, Jinja e Python</p>
+</div>
+
+<div class="main-content">
+    <div class="card">
+        <a href="{{ url_for('dashboard') }}" class="btn btn-secondary">Voltar ao Dashboard</a>
+        {% if enabled %}
+        <p style="margin-top:0.75rem;">Adiciona <code>?_profile=1</code> a qualquer página (sessão de administrador) ou envia o cabeçalho
+        abaixo, válido durante {{ token_minutes }} minutos. Amostragem automática: {{ (sample_rate * 100)|round(2) }}% dos pedidos.</p>
+        <pre style="white-space:pre-wrap; word-break:break-all;">{{ header }}: {{ token }}</pre>
+        {% else %}
+        <p style="margin-top:0.75rem;">O profiling está desligado (ativa-o com <code>ERASMUS_PROFILING=1</code>).</p>
+        {% endif %}
+    </div>
+
+    {% for profile in profiles %}
+    <div class="card">
+        <h4>{{ profile.method }} {{ profile.path }} <small>({{ profile.status }}, {{ profile.duration_ms }} ms)</small></h4>
+        <small>{{ profile.started }} · {{ profile.trigger }} ·
+            SQLite {{ profile.breakdown_ms.sqlite }} ms · Jinja {{ profile.breakdown_ms.jinja }} ms · Python {{ profile.breakdown_ms.python }} ms ·
+            <a href="{{ url_for('download_profile', name=profile.name) }}">{{ profile.name }}.pstats</a></small>
+        <details style="margin-top:0.5rem;">
+            <summary>Funções com mais tempo acumulado</summary>
+            <table style="width:100%; font-size:0.85rem;">
+                <tr><th style="text-align:left;">Função</th><th>Chamadas</th><th>Própria (ms)</th><th>Acumulada (ms)</th></tr>
+                {% for row in profile.top %}
+                <tr><td><code>{{ row.function }}</code></td><td>{{ row.calls }}</td><td>{{ row.tottime_ms }}</td><td>{{ row.cumtime_ms }}</td></tr>
+                {% endfor %}
+            </table>
+        </details>
+    </div>
+    {% else %}
+    <div class="card">Ainda não há perfis guardados.</div>
+    {% endfor %}
+</div>
+{% endblock %}''')
+
+    # ---------- admin_queue.html ----------
+    with open(os.path.join(templates_dir, 'admin_queue.html'), 'w', encoding='utf-8') as f:
+        f.write(r'''{% extends "base.html" %}
+{% block content %}
+<div class="hero">
+    <h1>Fila de Moderação</h1>
+    <p>Os depoimentos carregados ficam reservados para ti durante {{ lease_minutes }} minutos</p>
+</div>
+
+<div class="main-content">
+    <div class="card" style="display:flex; gap:0.5rem; flex-wrap:wrap;">
+        <a href="{{ url_for('dashboard') }}" class="btn btn-secondary">Voltar ao Dashboard</a>
+        <button class="btn" onclick="claimBatch()">Carregar próximos</button>
+        <button class="btn" style="background:var(--danger);" onclick="releaseAll()">Libertar reservas</button>
+    </div>
+
+    <div id="queue" style="display:grid; gap:1rem;"></div>
+    <div id="queueEmpty" class="card" style="display:none;">Não há depoimentos pendentes por reservar.</div>
+</div>
+
+<script>
+function renderItem(t) {
+    const card = document.createElement('div');
+    card.className = 'card';
+    card.id = 'testimonial-' + t.id;
+    const title = document.createElement('h4');
+    title.textContent = t.student_name;
+    const meta = document.createElement('small');
+    meta.textContent = t.university + ' — ' + t.country + ' (' + t.year + ') · reservado até ' + t.claimed_until + ' UTC';
+    const text = document.createElement('p');
+    text.style.marginTop = '0.5rem';
+    text.textContent = t.testimonial_text;
+    card.append(title, meta, text);
+    if (t.duplicate_of) {
+        const dup = document.createElement('small');
+        dup.style.color = 'var(--warning)';
+        dup.textContent = 'Possível duplicado do depoimento #' + t.duplicate_of;
+        card.append(dup);
+    }
+    const actions = document.createElement('div');
+    actions.style.cssText = 'display:flex; gap:0.5rem; margin-top:0.75rem;';
+    const approve = document.createElement('button');
+    approve.className = 'btn';
+    approve.textContent = 'Aprovar';
+    approve.onclick = () => moderate('approve', t.id);
+    const remove = document.createElement('button');
+    remove.className = 'btn';
+    remove.style.background = 'var(--danger)';
+    remove.textContent = 'Remover';
+    remove.onclick = () => moderate('delete', t.id);
+    actions.append(approve, remove);
+    card.append(actions);
+    return card;
+}
+
+async function claimBatch() {
+    try {
+        const res = await fetch('/api/moderation/claim?batch=10', { method:'POST' });
+        const r = await res.json();
+        const queue = document.getElementById('queue');
+        queue.innerHTML = '';
+        r.testimonials.forEach(t => queue.appendChild(renderItem(t)));
+        document.getElementById('queueEmpty').style.display = r.testimonials.length ? 'none' : 'block';
+    } catch(e){ alert('Erro de rede'); }
+}
+
+async function moderate(action, id) {
+    if(action === 'delete' && !confirm('Remover este depoimento? Não pode ser desfeito.')) return;
+    try {
+        const res = await fetch(`/api/testimonial/${action}/${id}`, { method:'POST' });
+        const r = await res.json();
+        if(r.success) { document.getElementById('testimonial-'+id).remove(); } else alert(r.message || 'Erro');
+        if(!document.getElementById('queue').children.length) claimBatch();
     } catch(e){ alert('Erro de rede'); }
 }
+
+async function releaseAll() {
+    await fetch('/api/moderation/release', { method:'POST' });
+    document.getElementById('queue').innerHTML = '';
+    document.getElementById('queueEmpty').style.display = 'none';
+}
+
+claimBatch();
 </script>
 {% endblock %}''')
 
@@ -908,7 +3217,7 @@ async function deleteTestimonial(id){
 
 <div class="main-content">
     <div class="card" style="text-align:center;">
-        <img id="flag" src="" alt="Bandeira" style="width:260px; border-radius:8px; border:1px solid rgba(0,0,0,0.06);">
+        <svg id="flag" viewBox="0 0 4 3" role="img" aria-label="Bandeira" style="width:260px; border-radius:8px; border:1px solid rgba(0,0,0,0.06);"><use id="flagUse" href="" width="4" height="3"></use></svg>
         <div style="margin-top:1rem;">
             <input id="guess" class="form-control" placeholder="Escreve o país (ex: Portugal)" style="max-width:420px; margin:0.6rem auto;">
             <div style="display:flex; gap:0.5rem; justify-content:center;">
@@ -916,54 +3225,101 @@ async function deleteTestimonial(id){
                 <button class="btn btn-accent" onclick="nextFlag()">Próxima</button>
             </div>
             <p id="result" style="margin-top:0.8rem; font-weight:700;"></p>
+            <p>Pontuação: <strong id="score">0</strong> / <span id="played">0</span></p>
         </div>
         <div style="margin-top:0.8rem;">
-            <small>Dicas: aceita acentos e variantes, p.ex. 'Reino Unido' / 'United Kingdom' não estão incluidos por defeito.</small>
+            <small>Dicas: aceita acentos e variantes, em português ou inglês (p.ex. 'Suécia' / 'Sweden'). Cada partida tem 10 bandeiras.</small>
         </div>
     </div>
+
+    <div class="card" style="text-align:center;">
+        <h3>Guardar pontuação</h3>
+        <div style="display:flex; gap:0.5rem; justify-content:center; flex-wrap:wrap;">
+            <input id="playerName" class="form-control" maxlength="40" placeholder="O teu nome" style="max-width:260px;">
+            <button class="btn btn-secondary" onclick="saveScore()">Guardar</button>
+        </div>
+        <h3 style="margin-top:1rem;">🏆 Melhores pontuações</h3>
+        <ol id="leaderboard" style="display:inline-block; text-align:left;"></ol>
+    </div>
+    <p style="text-align:center;"><small>Bandeiras: <a href="https://github.com/jdecked/twemoji">Twemoji</a>, licença <a href="https://creativecommons.org/licenses/by/4.0/">CC-BY 4.0</a>.</small></p>
 </div>
 
 <script>
-const flags = [
-    { country: "Portugal", flag: "https://flagcdn.com/w320/pt.png", aliases:["portugal"] },
-    { country: "Espanha", flag: "https://flagcdn.com/w320/es.png", aliases:["espanha","spain"] },
-    { country: "França", flag: "https://flagcdn.com/w320/fr.png", aliases:["frança","franca","france"] },
-    { country: "Itália", flag: "https://flagcdn.com/w320/it.png", aliases:["itália","italia","italy"] },
-    { country: "Alemanha", flag: "https://flagcdn.com/w320/de.png", aliases:["alemanha","germany","deutschland"] },
-    { country: "Polónia", flag: "https://flagcdn.com/w320/pl.png", aliases:["polónia","polonia","poland"] },
-    { country: "Grécia", flag: "https://flagcdn.com/w320/gr.png", aliases:["grécia","grecia","greece"] },
-    { country: "Suécia", flag: "https://flagcdn.com/w320/se.png", aliases:["suécia","suecia","sweden"] },
-    { country: "Irlanda", flag: "https://flagcdn.com/w320/ie.png", aliases:["irlanda","ireland"] }
-];
-
-let currentFlag = null;
-
-function normalize(text) {
-    return text.toLowerCase().normalize('NFD').replace(/[\u0300-\u036f]/g,'').trim();
+let batch = null;
+let rounds = [];
+let currentRound = null;
+
+async function postJSON(url, data) {
+    const res = await fetch(url, { method:'POST', headers:{ 'Content-Type':'application/json' }, body: JSON.stringify(data) });
+    return res.json();
 }
 
-function nextFlag() {
-    const idx = Math.floor(Math.random() * flags.length);
-    currentFlag = flags[idx];
-    document.getElementById('flag').src = currentFlag.flag;
+function showScore(r) {
+    document.getElementById('score').textContent = r.score;
+    document.getElementById('played').textContent = r.played;
+}
+
+async function nextFlag() {
+    if (!rounds.length) {
+        // each batch is one game; its score can be saved once
+        const res = await fetch('/api/game/round?count=10');
+        const r = await res.json();
+        if (!r.success) { document.getElementById('result').textContent = r.message; return; }
+        batch = r.batch;
+        rounds = r.rounds;
+        showScore(r);
+    }
+    currentRound = rounds.shift();
+    document.getElementById('flagUse').setAttribute('href', currentRound.flag);
     document.getElementById('guess').value = '';
     document.getElementById('result').textContent = '';
 }
 
-function checkGuess() {
-    const val = normalize(document.getElementById('guess').value || '');
-    if(!val) { alert('Escreve o nome do país'); return; }
-    const ok = currentFlag.aliases.map(normalize).includes(val) || normalize(currentFlag.country) === val;
-    if(ok) {
-        document.getElementById('result').textContent = '✅ Correto! É ' + currentFlag.country;
-        document.getElementById('result').style.color = 'var(--success)';
+async function checkGuess() {
+    const guess = document.getElementById('guess').value.trim();
+    if(!guess) { alert('Escreve o nome do país'); return; }
+    if(currentRound === null) return;
+    const r = await postJSON('/api/game/guess', { batch: batch, round: currentRound.round, guess: guess });
+    currentRound = null;
+    const result = document.getElementById('result');
+    if(!r.success) {
+        result.textContent = r.message;
+        return;
+    }
+    showScore(r);
+    if(r.correct) {
+        result.textContent = '✅ Correto! É ' + r.country;
+        result.style.color = 'var(--success)';
     } else {
-        document.getElementById('result').textContent = '❌ Errado — era ' + currentFlag.country;
-        document.getElementById('result').style.color = 'var(--danger)';
+        result.textContent = '❌ Errado — era ' + r.country;
+        result.style.color = 'var(--danger)';
     }
 }
 
+async function loadLeaderboard() {
+    const res = await fetch('/api/game/leaderboard?limit=10');
+    const r = await res.json();
+    const list = document.getElementById('leaderboard');
+    list.innerHTML = '';
+    r.scores.forEach(s => {
+        const li = document.createElement('li');
+        li.textContent = s.player_name + ' — ' + s.score + ' / ' + s.rounds;
+        list.appendChild(li);
+    });
+}
+
+async function saveScore() {
+    const r = await postJSON('/api/game/score', { batch: batch, player_name: document.getElementById('playerName').value });
+    if(!r.success) { alert(r.message); return; }
+    alert('Pontuação guardada! Posição #' + r.rank);
+    showScore({ score: 0, played: 0 });
+    rounds = [];
+    loadLeaderboard();
+    nextFlag();
+}
+
 nextFlag();
+loadLeaderboard();
 </script>
 {% endblock %}''')
 
@@ -972,7 +3328,8 @@ create_templates()
 
 if __name__ == '__main__':
     print("🚀 Iniciando servidor Erasmus+...")
-    print("📊 Base de dados inicializada (se necessário).")
+    migrate()
+    print("📊 Base de dados migrada (se necessário).")
     print("🎨 Templates criados (templates/).")
     print("🔐 Admin: username='admin', password='admin123' — altera em produção!")
     app.run(debug=True, host='0.0.0.0', port=5000)
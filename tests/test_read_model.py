@@ -0,0 +1,108 @@
+"""The in-memory read model must answer /depoimentos exactly like SQLite."""
+import sqlite3
+
+import pytest
+
+import erasmus
+
+FILTERS = [
+    ('', '', ''),
+    ('Espanha', '', ''),
+    ('spain', '', ''),
+    ('França', '', ''),
+    ('', '2020', ''),
+    ('', '', 'cultura'),
+    ('', '', 'VIAG'),
+    ('Espanha', '2021', 'viagens'),
+    ('Atlântida', '', ''),
+]
+OFFSETS = [0, 3, 7, 20]
+PER_PAGE = 4
+
+ROWS = [
+    # (country, year, tags, is_approved, created_at) -- several rows share a created_at
+    ('Espanha', 2020, 'cultura, viagens', 1, '2024-01-01 10:00:00'),
+    ('spain', 2021, 'viagens', 1, '2024-01-01 10:00:00'),
+    ('ES', 2021, 'viagens, música', 1, '2024-01-01 10:00:00'),
+    ('França', 2020, 'cultura', 1, '2024-01-02 09:00:00'),
+    ('france', 2019, '', 1, '2024-01-02 09:00:00'),
+    ('Itália', 2020, None, 1, '2023-12-31 23:59:59'),
+    ('Portugal', 2022, 'idiomas', 0, '2024-01-03 08:00:00'),
+    ('Espanha', 2021, 'viagens', 0, '2024-01-01 10:00:00'),
+    ('Alemanha', 2020, 'cultura', 1, '2024-01-01 10:00:00'),
+    ('Áustria', 2018, 'desporto', 1, '2022-06-01 12:00:00'),
+    ('Suécia', 2020, 'viagens, cultura', 1, '2024-01-02 09:00:00'),
+]
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'erasmus.db')
+    erasmus.migrate(path)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    for i, (country, year, tags, approved, created_at) in enumerate(ROWS):
+        country_id, _ = erasmus.resolve_country(conn, country)
+        conn.execute('''
+            INSERT INTO testimonials (student_name, country, country_id, university, year, testimonial_text,
+                                      tags, is_approved, created_at)
+            VALUES (?, ?, ?, 'Universidade', ?, ?, ?, ?, ?)
+        ''', (f'Estudante {i}', country, country_id, year, f'Texto {i}', tags, approved, created_at))
+    conn.commit()
+    yield path, conn
+    conn.close()
+
+
+def assert_same_pages(model, conn):
+    for country, year, tag in FILTERS:
+        for offset in OFFSETS:
+            expected = erasmus.fetch_testimonials_page(conn, country, year, tag, PER_PAGE, offset)
+            actual = model.fetch_page(conn, country, year, tag, PER_PAGE, offset)
+            context = (country, year, tag, offset)
+            assert [row['id'] for row in actual[0]] == [row['id'] for row in expected[0]], context
+            assert actual[1] == expected[1], context
+            assert [row['country'] for row in actual[2]] == [row['country'] for row in expected[2]], context
+            assert [row['year'] for row in actual[3]] == [row['year'] for row in expected[3]], context
+            assert actual[4] == expected[4], context
+
+
+def test_read_model_matches_sqlite_through_changes(database):
+    path, conn = database
+    model = erasmus.TestimonialReadModel(path)
+    assert_same_pages(model, conn)
+
+    # approve
+    conn.execute('UPDATE testimonials SET is_approved = 1 WHERE student_name IN (?, ?)',
+                 ('Estudante 6', 'Estudante 7'))
+    conn.commit()
+    assert_same_pages(model, conn)
+
+    # delete
+    erasmus.remove_testimonial(conn, conn.execute(
+        "SELECT id FROM testimonials WHERE student_name = 'Estudante 3'").fetchone()['id'])
+    erasmus.remove_testimonial(conn, conn.execute(
+        "SELECT id FROM testimonials WHERE student_name = 'Estudante 9'").fetchone()['id'])
+    conn.commit()
+    assert_same_pages(model, conn)
+
+    # update facets and the sort key
+    conn.execute('''
+        UPDATE testimonials SET year = 2021, tags = 'cultura', created_at = '2024-01-01 10:00:00'
+        WHERE student_name = 'Estudante 5'
+    ''')
+    conn.execute("UPDATE testimonials SET is_approved = 0 WHERE student_name = 'Estudante 0'")
+    conn.commit()
+    assert_same_pages(model, conn)
+
+
+def test_read_model_reloads_after_change_log_prune(database):
+    path, conn = database
+    model = erasmus.TestimonialReadModel(path)
+    assert_same_pages(model, conn)
+
+    conn.execute("UPDATE testimonials SET is_approved = 1 WHERE student_name = 'Estudante 6'")
+    conn.execute("UPDATE testimonials SET tags = 'arte' WHERE student_name = 'Estudante 1'")
+    # what prune_change_log does once the model has fallen behind
+    conn.execute('DELETE FROM testimonial_changes WHERE seq < (SELECT MAX(seq) FROM testimonial_changes)')
+    conn.commit()
+    assert_same_pages(model, conn)